@@ -15,8 +15,11 @@ if '__path__' not in globals():
   __path__ = [__DIR__]
 
 from . import __version__
+from .cache import commands, documents, CommandStore
 from .exceptions import Error, Required
+from .parsers import load, load_all
 from .resources import Resources, Resource
+from .runner import runner
 from .settings import merge
 from collections.abc import Sequence
 from subprocess import CalledProcessError
@@ -46,7 +49,7 @@ def read_args(resource:Resource, path:Sequence):
   paths = [path] if isinstance(path, str) else path
 
   if len(paths) == 1 and paths[0] == '-':
-    return [_ for _ in yaml.safe_load_all(stdin)]
+    return load_all(stdin)
 
   args = []
   last = None
@@ -58,7 +61,7 @@ def read_args(resource:Resource, path:Sequence):
     # Read arguments from standard input, if PATH is -
     if path == '-':
       # Overwrite PATH properties, if also set from standard input
-      merge(last, yaml.safe_load(stdin), clone=False)
+      merge(last, load(stdin), clone=False)
     else:
       # Properties linked to PATH are set automatically
       merge(last, resource.path(path), clone=False)
@@ -132,9 +135,16 @@ With RESOURCE, dump resource configuration to stdout.
   help="Overwrite the object, if exists.",
   is_flag=True,
 )
+@click.option(
+  '--checkpoint',
+  default=0,
+  help='Write changed files every N changes, instead of only at the end.',
+  metavar='N',
+  type=click.IntRange(min=0),
+)
 @click.argument('resource')
 @click.argument('path', required=False, nargs=-1)
-def cli_create(resource, path=None, **opts):
+def cli_create(resource, path=None, checkpoint=0, **opts):
   """Creates an object from stdin.
 
 RESOURCE must be specified. Use 'tfadm resources' for a complete list of
@@ -145,11 +155,14 @@ properties from stdin.
 
 If the object already exists, tfadm will error out, unless the '-o', or
 '--overwrite' option is given.
+
+Changed files are written once, after all the objects are created.
 """
   resource = Resources().load(resource)
 
-  for args in read_args(resource, path):
-    resource('create', args, defaults=True, **opts)
+  with documents.batch(checkpoint):
+    for args in read_args(resource, path):
+      resource('create', args, defaults=True, **opts)
 
 @cli.command('update')
 @click.option(
@@ -158,10 +171,17 @@ If the object already exists, tfadm will error out, unless the '-o', or
   help="Only print the object that would be saved, without saving it.",
   is_flag=True,
 )
+@click.option(
+  '--checkpoint',
+  default=0,
+  help='Write changed files every N changes, instead of only at the end.',
+  metavar='N',
+  type=click.IntRange(min=0),
+)
 @click.argument('resource')
 @click.argument('path', required=False, nargs=-1)
 @click.pass_context
-def cli_update(ctx, resource, path=None, **opts):
+def cli_update(ctx, resource, path=None, checkpoint=0, **opts):
   """Updates an object from stdin.
 
 RESOURCE must be specified. Use 'tfadm resources' for a complete list of
@@ -171,11 +191,14 @@ PATH is the filesystem path where the object is stored, relative to tfadm
 project's root directory. When PATH is -, reads object attributes from stdin.
 
 The object will be created if it doesn't exist.
+
+Changed files are written once, after all the objects are updated.
 """
   resource = Resources().load(resource)
 
-  for args in read_args(resource, path):
-    resource('update', args, **opts)
+  with documents.batch(checkpoint):
+    for args in read_args(resource, path):
+      resource('update', args, **opts)
 
 @cli.command('sync')
 @click.option(
@@ -196,9 +219,41 @@ The object will be created if it doesn't exist.
   help='Associate existing infrastructure with Terraform resources.',
   is_flag=True,
 )
+@click.option(
+  '-j', '--jobs',
+  default=1,
+  help='Without RESOURCE, number of independent resources to sync concurrently.',
+  type=click.IntRange(min=1),
+)
+@click.option(
+  '--checkpoint',
+  default=0,
+  help='Write changed files every N changes, instead of only at the end.',
+  metavar='N',
+  type=click.IntRange(min=0),
+)
+@click.option(
+  '--max-commands',
+  default=8,
+  help='Number of sync commands to run at a time, at most, streamed ones aside.',
+  metavar='N',
+  type=click.IntRange(min=1),
+)
+@click.option(
+  '--cache-ttl',
+  default=0,
+  help='Reuse command outputs cached on disk for up to SECONDS.',
+  metavar='SECONDS',
+  type=click.IntRange(min=0),
+)
+@click.option(
+  '--refresh',
+  is_flag=True,
+  help='With --cache-ttl, run commands again, refreshing their cached outputs.',
+)
 @click.argument('resource', required=False)
 @click.argument('path', required=False, nargs=-1)
-def cli_sync(resource, path=None, **opts):
+def cli_sync(resource, path=None, jobs=1, checkpoint=0, max_commands=8, cache_ttl=0, refresh=False, **opts):
   """Copies changes to the infrastructure into Terraform code.
 
 Without RESOURCE, converts the existing infrastructure into Terraform code.
@@ -206,13 +261,32 @@ Without RESOURCE, converts the existing infrastructure into Terraform code.
 When RESOURCE or PATH is '-', filters existing infrastructure by stdin, copying
 only matching objects. JSON and YAML formats are supported.
 
+With '-j', or '--jobs', resources that do not depend on each other are synced
+concurrently, each one only after the resources it depends on.
+
+Changed files are written once, at the end or before running Terraform, unless
+'--checkpoint' is given.
+
+Commands of a resource that do not depend on each other's output run
+concurrently, up to '--max-commands' at a time overall, while objects are
+still copied in order. Streamed commands run while their objects are copied,
+and are not counted.
+
+With '--cache-ttl', the output of describe and list commands is cached under
+'.tfadm/cache/commands', and reused by later runs until it expires. The
+commands run again with '--refresh'.
+
 Use 'tfadm resources' for a complete list of available resources.
 """
   resources = Resources()
+  runner.limit = max_commands
+
+  if cache_ttl:
+    commands.store = CommandStore(resources.config_dir / 'cache' / 'commands', cache_ttl, refresh=refresh)
 
   if resource == '-' and not path:
     resource = None
-    args = [_ for _ in yaml.safe_load_all(stdin)]
+    args = load_all(stdin)
   elif resource is not None:
     resource = resources.load(resource)
     args = read_args(resource, path)
@@ -224,12 +298,16 @@ Use 'tfadm resources' for a complete list of available resources.
 
   if not args:
     args = [None]
-
-  for _ in args:
-    if resource is None:
-      resources.loadAll().each(lambda r, args: r('sync', args, **opts), None, _)
-    else:
-      resource('sync', _, **opts)
+  elif len(args) > 1:
+    # Synced all at once, see Sync.execute_all
+    args = [args]
+
+  with documents.batch(checkpoint):
+    for _ in args:
+      if resource is None:
+        resources.loadAll().each(lambda r, args: r('sync', args, **opts), None, _, jobs=jobs)
+      else:
+        resource('sync', _, **opts)
 
 if __name__ == '__main__':
   exit(main())
@@ -0,0 +1,431 @@
+from . import __version__
+from .locks import filelock
+from .settings import Settings
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from hashlib import blake2b
+from json import dumps as tojson
+from os import environ, fdopen, getcwd, replace, stat, unlink
+from os.path import abspath
+from pathlib import Path
+from tempfile import mkstemp
+from threading import Lock, Thread
+from time import time
+import gzip
+import pickle
+
+class CommandCache:
+  """Process-wide, bounded LRU cache of the parsed output of commands, by argv.
+
+  Concurrent requests for the same command wait for a single run of it. Keeps
+  hit, miss and byte counts (see `stats`). `store` is an optional CommandStore,
+  to keep the raw output across runs.
+  """
+  def __init__(self, maxsize:int=128, maxbytes:int=256 << 20):
+    self.maxsize = maxsize
+    self.maxbytes = maxbytes
+    self.entries = OrderedDict()
+    self.running = {}
+    self.store = None
+    self.mutex = Lock()
+    self.hits = 0
+    self.misses = 0
+    self.bytes = 0
+
+  def __contains__(self, argv:list) -> bool:
+    key = tuple(argv)
+
+    with self.mutex:
+      return key in self.entries or key in self.running
+
+  def clear(self):
+    with self.mutex:
+      self.entries.clear()
+      self.bytes = 0
+
+  def run(self, argv:list, fn) -> list:
+    """Returns the output of `argv` and whether it was cached.
+
+    On a miss, `fn` is called to run the command, returning its parsed output
+    and size in bytes. Errors are raised to all the waiting callers, and not
+    cached.
+    """
+    key = tuple(argv)
+
+    with self.mutex:
+      entry = self.entries.get(key)
+
+      if entry is not None:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return [entry[0], True]
+
+      flight = self.running.get(key)
+
+      if flight is not None:
+        self.hits += 1
+      else:
+        self.running[key] = Future()
+        self.misses += 1
+
+    if flight is not None:
+      return [flight.result(), True]
+
+    return [self._complete(key, fn), False]
+
+  def start(self, argv:list, fn) -> Future:
+    """Same as run, in a background thread, on a miss only.
+
+    Returns the future of the output, or None if cached or already running,
+    so that concurrent requests for the same command wait for this run of it.
+    """
+    key = tuple(argv)
+
+    with self.mutex:
+      if key in self.entries or key in self.running:
+        return None
+
+      flight = self.running[key] = Future()
+      self.misses += 1
+
+    def complete():
+      try:
+        self._complete(key, fn)
+      except BaseException:
+        # Raised by the future
+        pass
+
+    Thread(target=complete, name='prefetch', daemon=True).start()
+    return flight
+
+  def stats(self) -> dict:
+    with self.mutex:
+      return {'hits': self.hits, 'misses': self.misses, 'bytes': self.bytes, 'entries': len(self.entries)}
+
+  def _complete(self, key:tuple, fn):
+    # Runs the flight of `key`, see run
+    with self.mutex:
+      flight = self.running[key]
+
+    try:
+      value, size = fn()
+    except BaseException as e:
+      with self.mutex:
+        del self.running[key]
+
+      flight.set_exception(e)
+      raise
+
+    with self.mutex:
+      del self.running[key]
+      self.entries[key] = (value, size)
+      self.bytes += size
+
+      while self.entries and (len(self.entries) > self.maxsize or self.bytes > self.maxbytes):
+        _, (_, size_) = self.entries.popitem(last=False)
+        self.bytes -= size_
+
+    flight.set_result(value)
+    return value
+
+class CommandStore:
+  """On-disk cache of the raw output of commands, gzip compressed.
+
+  Entries are keyed by argv, working directory and the environment variables
+  that select cloud accounts, projects or regions, and expire `ttl` seconds
+  after written. With `refresh`, they are written but never read. The least
+  recently written entries are evicted beyond `maxbytes`.
+  """
+  environment = ('ARM_', 'AWS_', 'AZURE_', 'CLOUDSDK_', 'GOOGLE_', 'KUBECONFIG')
+
+  def __init__(self, directory, ttl:int, refresh:bool=False, maxbytes:int=256 << 20):
+    self.directory = Path(directory)
+    self.ttl = ttl
+    self.refresh = refresh
+    self.maxbytes = maxbytes
+    self.mutex = Lock()
+
+  def __contains__(self, argv:list) -> bool:
+    """Whether `load` would return the output of `argv`."""
+    if self.refresh:
+      return False
+
+    try:
+      return time() - self.filename(argv).stat().st_mtime <= self.ttl
+    except OSError:
+      return False
+
+  def evict(self):
+    entries = []
+    size = 0
+
+    for filename in self.directory.glob('*.gz'):
+      try:
+        st = filename.stat()
+      except OSError:
+        continue
+
+      entries.append((st.st_mtime_ns, st.st_size, filename))
+      size += st.st_size
+
+    entries.sort()
+
+    for _, size_, filename in entries:
+      if size <= self.maxbytes:
+        break
+
+      try:
+        filename.unlink()
+      except OSError:
+        pass
+
+      size -= size_
+
+  def filename(self, argv:list) -> Path:
+    env = sorted(_ for _ in environ.items() if _[0].startswith(self.environment))
+    key = tojson([list(argv), getcwd(), env]).encode()
+    return self.directory / (blake2b(key, digest_size=20).hexdigest() + '.gz')
+
+  def load(self, argv:list) -> bytes:
+    """Returns the output of `argv`, or None if not cached or expired."""
+    if self.refresh:
+      return None
+
+    try:
+      with open(self.filename(argv), 'rb') as fp:
+        if time() - stat(fp.fileno()).st_mtime > self.ttl:
+          return None
+
+        return gzip.decompress(fp.read())
+    except (OSError, EOFError):
+      return None
+
+  def save(self, argv:list, output:bytes):
+    tmp = None
+
+    try:
+      if not self.directory.is_dir():
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # Outputs may hold secrets, never to be committed with the project
+        (self.directory / '.gitignore').write_text('*\n')
+
+      # Private to the user, as outputs may hold secrets
+      fd, tmp = mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+
+      with fdopen(fd, 'wb') as fp:
+        fp.write(gzip.compress(output, mtime=0))
+
+      replace(tmp, self.filename(argv))
+      tmp = None
+
+      with self.mutex:
+        self.evict()
+    except OSError:
+      if tmp:
+        try:
+          unlink(tmp)
+        except OSError:
+          pass
+
+def signature(filename) -> tuple:
+  """Returns the (mtime, size) signature of a file, or None if missing."""
+  try:
+    st = stat(filename)
+  except OSError:
+    return None
+
+  return (st.st_mtime_ns, st.st_size)
+
+def user_cache_dir() -> Path:
+  """Returns the directory of tfadm's caches that are kept out of projects."""
+  return Path(environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / __package__
+
+def sources() -> dict:
+  """Returns the signatures of tfadm's own source files."""
+  return {str(_): signature(_) for _ in Path(__file__).parent.rglob('*.py')}
+
+class ResourceCache:
+  """On-disk cache of fully resolved resources.
+
+  Entries are keyed by the signature of every file read to resolve them
+  (resource files, `extends` and `parent` chains and the resource directories
+  themselves) plus the tfadm version and sources, and the project directory
+  and resource search paths, so the whole cache is discarded as soon as any
+  of them changes.
+
+  The cache is kept under the user's cache directory, one file per project
+  directory, as unpickling a file from the project could run any code.
+  """
+  def __init__(self, root_dir, paths:list):
+    self.key = {'root_dir': str(root_dir), 'paths': [str(_) for _ in paths]}
+    name = blake2b(str(root_dir).encode(), digest_size=16).hexdigest()
+    self.filename = user_cache_dir() / 'resources' / (name + '.pickle')
+
+  def load(self) -> list:
+    try:
+      with open(self.filename, 'rb') as fp:
+        data = pickle.load(fp)
+    except Exception:
+      return [{}, {}]
+
+    if not isinstance(data, dict) or data.get('version') != __version__:
+      return [{}, {}]
+
+    if data.get('key') != self.key or data.get('sources') != sources():
+      return [{}, {}]
+
+    files = data.get('files', {})
+
+    for filename, sig in files.items():
+      if signature(filename) != sig:
+        return [{}, {}]
+
+    return [files, data.get('resources', {})]
+
+  def save(self, files:dict, resources:dict):
+    data = {'version': __version__, 'key': self.key, 'sources': sources(), 'files': files, 'resources': resources}
+    tmp = self.filename.with_name(self.filename.name + '.tmp')
+
+    try:
+      self.filename.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+      with open(tmp, 'wb') as fp:
+        pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+      replace(tmp, self.filename)
+    except Exception:
+      try:
+        tmp.unlink()
+      except OSError:
+        pass
+
+class DocumentCache:
+  """Process-wide cache of parsed documents, such as Terraform files.
+
+  Entries are validated against the (mtime, size, inode) of the file, so
+  changes made by other programs are picked up, while saving a document
+  through the cache updates it instead of invalidating it.
+
+  Loaded documents share their containers with the last saved state, and are
+  meant to be changed copy-on-write under `lock` (see merge, unshare and
+  detach): if they are not saved, only their own changes are lost.
+
+  Within `batch`, saved documents are only written when the outermost batch
+  ends, every `checkpoint` saves, or on `flush`, each file once.
+  """
+  def __init__(self):
+    self.documents = {}
+    self.mutex = Lock()
+    self.batches = 0
+    self.checkpoint = 0
+    self.dirty = {}
+    self.changes = 0
+
+  @staticmethod
+  def signature(filename) -> tuple:
+    st = stat(filename)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+  @contextmanager
+  def batch(self, checkpoint:int=0):
+    with self.mutex:
+      self.batches += 1
+      outer = self.checkpoint
+
+      if checkpoint:
+        self.checkpoint = checkpoint
+
+    try:
+      yield self
+    finally:
+      with self.mutex:
+        self.batches -= 1
+        self.checkpoint = outer
+        last = not self.batches
+
+      if last:
+        self.flush()
+
+  def dump(self, filename:str, data, **opts) -> bool:
+    """Saves a document, returning whether written, or None if deferred."""
+    key = abspath(filename)
+    data = data.data if isinstance(data, Settings) else data
+
+    with self.mutex:
+      if self.batches:
+        self.documents[key] = (None, data)
+        self.dirty[key] = (filename, opts)
+        self.changes += 1
+        return None
+
+    return self._write(key, filename, data, opts)
+
+  def flush(self):
+    """Writes all the documents saved within a batch."""
+    with self.mutex:
+      keys = list(self.dirty)
+      self.changes = 0
+
+    for key in keys:
+      with filelock(key):
+        with self.mutex:
+          pending = self.dirty.pop(key, None)
+          entry = self.documents.get(key)
+
+        if pending is not None and entry is not None:
+          self._write(key, pending[0], entry[1], pending[1])
+
+  def forget(self, filename:str):
+    key = abspath(filename)
+
+    with self.mutex:
+      self.documents.pop(key, None)
+      self.dirty.pop(key, None)
+
+  def load(self, filename:str) -> Settings:
+    key = abspath(filename)
+
+    with self.mutex:
+      entry = self.documents.get(key)
+
+      if key in self.dirty:
+        return Settings({**entry[1]})
+
+    # Raises FileNotFoundError, like Settings.load
+    sig = self.signature(filename)
+
+    if entry is not None and entry[0] == sig:
+      return Settings({**entry[1]})
+
+    data = Settings.load(filename).data
+
+    with self.mutex:
+      self.documents[key] = (sig, data)
+
+    return Settings({**data})
+
+  @contextmanager
+  def lock(self, filename:str):
+    """Serializes changes to a document."""
+    with filelock(abspath(filename)):
+      try:
+        yield self
+      finally:
+        with self.mutex:
+          checkpoint = self.checkpoint and self.changes >= self.checkpoint
+
+    if checkpoint:
+      self.flush()
+
+  def _write(self, key:str, filename:str, data, opts:dict) -> bool:
+    written = Settings.dump(filename, data, **opts)
+    sig = self.signature(filename)
+
+    with self.mutex:
+      self.documents[key] = (sig, data)
+
+    return written
+
+commands = CommandCache()
+documents = DocumentCache()
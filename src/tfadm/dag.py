@@ -0,0 +1,116 @@
+from .exceptions import Error
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class CycleError(Error):
+  """Circular dependency"""
+  def __init__(self, context, cycle:list):
+    self.cycle = cycle
+    super().__init__(context, 'Circular dependency', ' -> '.join(cycle))
+
+def toposort(nodes:list, depends_on:dict) -> list:
+  """Sorts `nodes` so that each one comes after all its dependencies.
+
+  `depends_on` maps each node to the nodes it depends on, which must all be
+  in `nodes`. Uses Kahn's algorithm with a FIFO queue, so independent nodes
+  keep their relative order. Raises CycleError with the path of the first
+  cycle found, if any.
+  """
+  pending, dependents = indegrees(nodes, depends_on)
+  queue = deque(node for node in nodes if not pending[node])
+  order = []
+
+  while queue:
+    node = queue.popleft()
+    order.append(node)
+
+    for dependent in dependents[node]:
+      pending[dependent] -= 1
+
+      if not pending[dependent]:
+        queue.append(dependent)
+
+  if len(order) < len(nodes):
+    cycle = findcycle([node for node in nodes if pending[node]], depends_on)
+    raise CycleError(cycle[0], cycle)
+
+  return order
+
+def execute(nodes:list, depends_on:dict, callback, jobs:int) -> int:
+  """Calls `callback` for each of the `nodes` on a pool of `jobs` threads.
+
+  A node is only submitted once all its dependencies returned, so `nodes`
+  must be free of cycles (see toposort). After the first error no more nodes
+  are submitted, and the error is raised once the running ones finish.
+  Returns the number of nodes that completed.
+  """
+  pending, dependents = indegrees(nodes, depends_on)
+  running = {}
+  error = None
+  count = 0
+
+  with ThreadPoolExecutor(max_workers=jobs) as pool:
+    def submit(node):
+      running[pool.submit(callback, node)] = node
+
+    for node in nodes:
+      if not pending[node]:
+        submit(node)
+
+    while running:
+      done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+      for future in done:
+        node = running.pop(future)
+        e = future.exception()
+
+        if e is not None:
+          if error is None:
+            error = e
+
+          continue
+
+        count += 1
+
+        if error is not None:
+          continue
+
+        for dependent in dependents[node]:
+          pending[dependent] -= 1
+
+          if not pending[dependent]:
+            submit(dependent)
+
+  if error is not None:
+    raise error
+
+  return count
+
+def indegrees(nodes:list, depends_on:dict) -> list:
+  """Counts the pending dependencies and lists the dependents of each node."""
+  pending = {}
+  dependents = {node: [] for node in nodes}
+
+  for node in nodes:
+    deps = set(depends_on.get(node, ()))
+    deps.discard(node)
+    pending[node] = len(deps)
+
+    for dependency in deps:
+      dependents[dependency].append(node)
+
+  return [pending, dependents]
+
+def findcycle(nodes:list, depends_on:dict) -> list:
+  """Returns the path of a cycle among `nodes`, which must contain one."""
+  remaining = set(nodes)
+  path = []
+  index = {}
+  node = nodes[0]
+
+  while node not in index:
+    index[node] = len(path)
+    path.append(node)
+    node = next(_ for _ in depends_on[node] if _ in remaining and _ != node)
+
+  return path[index[node]:] + [node]
@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+from hashlib import blake2b
+from io import BufferedWriter, RawIOBase, TextIOWrapper
+from os import chmod, fdopen, replace, stat, umask, unlink
+from os.path import basename, dirname, realpath
+from stat import S_IMODE
+from tempfile import mkstemp
+
+# There is no way to read the umask without setting it
+UMASK = umask(0o022)
+umask(UMASK)
+
+class HashingWriter(RawIOBase):
+  """Binary stream writing through to `fp`, while hashing and counting bytes."""
+  def __init__(self, fp):
+    self.fp = fp
+    self.hash = blake2b()
+    self.size = 0
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, b) -> int:
+    self.hash.update(b)
+    self.size += len(b)
+    return self.fp.write(b)
+
+def digest(filename, size:int=None):
+  """Returns the hash of a file, or None if missing or not `size` bytes long."""
+  try:
+    with open(filename, 'rb') as fp:
+      if size is not None and stat(fp.fileno()).st_size != size:
+        return None
+
+      hash = blake2b()
+
+      for chunk in iter(lambda: fp.read(1 << 20), b''):
+        hash.update(chunk)
+  except OSError:
+    return None
+
+  return hash.digest()
+
+@contextmanager
+def atomic_write(filename:str):
+  """Opens a temporary text file to be renamed over `filename` when closed.
+
+  The content is hashed while written, so an unchanged file is left alone.
+  Yields the file object, whose `written` attribute is set on exit to whether
+  `filename` was actually replaced. Keeps the mode of an existing file.
+  """
+  filename = realpath(filename)
+  fd, tmp = mkstemp(dir=dirname(filename), prefix='.' + basename(filename) + '.', suffix='.tmp')
+
+  try:
+    with fdopen(fd, 'wb') as raw:
+      writer = HashingWriter(raw)
+      fp = TextIOWrapper(BufferedWriter(writer))
+      fp.written = False
+
+      try:
+        yield fp
+        fp.flush()
+      except BaseException:
+        # Before `raw`, so nothing is flushed into it once closed
+        fp.close()
+        raise
+
+      fp.detach()
+
+    if digest(filename, writer.size) == writer.hash.digest():
+      unlink(tmp)
+      return
+
+    try:
+      mode = S_IMODE(stat(filename).st_mode)
+    except FileNotFoundError:
+      mode = 0o666 & ~UMASK
+
+    chmod(tmp, mode)
+    replace(tmp, filename)
+    fp.written = True
+  except BaseException:
+    try:
+      unlink(tmp)
+    except OSError:
+      pass
+
+    raise
@@ -0,0 +1,17 @@
+from os.path import abspath
+from threading import Lock, RLock
+
+locks = {}
+lock = Lock()
+
+def filelock(filename) -> RLock:
+  """Returns the process-wide lock serializing changes to `filename`."""
+  key = abspath(filename)
+
+  with lock:
+    this = locks.get(key)
+
+    if this is None:
+      locks[key] = this = RLock()
+
+  return this
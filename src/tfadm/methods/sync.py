@@ -1,27 +1,36 @@
 from . import Method
-from ..exceptions import Error, PatternError, RequiredArgument
-from ..settings import match, merge, pprint, Descriptor
-from ..template import jinja
-from collections.abc import Mapping
+from ..cache import commands
+from ..exceptions import Error, PatternError, Required, RequiredArgument
+from ..parsers import iterjson, loads
+from ..runner import runner, Retry
+from ..settings import compile_index, compile_match, getter, merge, pprint, scalar_types, Descriptor
+from ..template import compile_expression
+from collections.abc import Iterator, Mapping
+from contextlib import nullcontext
+from itertools import chain, islice
 from json import dumps as tojson
 from shlex import split as splitcmd, join as joincmd
-from subprocess import check_output
-from yaml import load as loadyaml, FullLoader
+from subprocess import CalledProcessError, Popen, PIPE
+from tempfile import TemporaryFile
+from time import sleep
 from click import secho
+import sys
 
 class Sync(Method):
+  # Number of streamed objects projected at a time
+  batch_size = 256
+  concurrency = Descriptor('concurrency', 4)
+  join = Descriptor('join', False)
+  shards = Descriptor('shards', {})
   when = Descriptor('when', {})
 
-  class Chache:
-    def __init__(self, cmd:str, settings:Mapping):
-      self.cmd = cmd
-      self.settings = settings
-
   def __init__(self, owner, cfg:Mapping, key:str):
     super().__init__(owner, cfg, key + '/sync')
-    self.cache = None
+    self.matcher = None
+    self.partitions = {}
+    self.retry = None
 
-    for action in ['describe', 'list']:
+    for action in ['bulk', 'describe', 'list']:
       format_specs = self.data.get(action)
 
       if format_specs:
@@ -37,6 +46,13 @@ class Sync(Method):
 
         self[action] = format_specs
 
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['matcher'] = None
+    state['partitions'] = {}
+    state['retry'] = None
+    return state
+
   def _inherit(self):
     super()._inherit()
 
@@ -87,102 +103,182 @@ class Sync(Method):
 
       if recursive:
         args = resource.properties.heritage(args)
-        resource.owner.each(lambda r, args: r('sync', args, **opts), resource, args)
+        resource.owner.each(lambda r, args: r('sync', args, **dict(opts, bulk=True)), resource, args)
+
+    if isinstance(filters, list):
+      return self.execute_all('describe', filters, update, fallback='list', force=opts.get('force', False))
+
+    if opts.get('bulk') and self.get('bulk') and self.parent and isinstance(filters, Mapping):
+      return self.bulk(filters, update, force=opts.get('force', False))
 
     return self.describe(filters, update, force=opts.get('force', False))
 
-  def describe(self, filters:Mapping, callback, **opts) -> int:
-    return self.execute('describe', filters, callback, fallback='list', **opts)
+  def bulk(self, filters:Mapping, callback, **opts) -> int:
+    """Same as describe for the objects of one parent, `filters` being its
+    heritage, but out of the output of the `bulk` command, listing the objects
+    of all parents at once.
 
-  def list(self, filters:Mapping, callback, **opts) -> int:
-    return self.execute('list', filters, callback, fallback='describe', **opts)
+    The command runs once, and its objects are partitioned by the inherited
+    properties of the parent they sync, those syncing none being left out.
+    Falls back to describe if the command needs other arguments.
+    """
+    props = self.owner.properties
+    leaves = self.parent.owner.properties.leaves[1]
+    args = props(filters, defaults=False, slugs=False)
+    cmd_args, err = self.command('bulk', args)
 
-  def execute(self, action:str, filters:Mapping, callback, fallback:str=None, **opts) -> int:
-    parent = self.parent
-    format_specs = self.get(action)
+    if err:
+      return self.describe(filters, callback, **opts)
 
-    if not format_specs and fallback:
-      format_specs = self.get(fallback)
-      action = fallback
-      fallback = None
+    cmd = tuple(cmd_args)
+    partitions = self.partitions.get(cmd)
 
-    if not format_specs:
-      return parent.list(filters, callback) if parent else 0
+    if partitions is None:
+      partitions = self.partitions[cmd] = self.partition(self.run(cmd_args))
 
-    i = 0
-    count = len(format_specs)
-    props = self.owner.properties
-    args = props(filters, defaults=False, slugs=False)
-    pprops = parent.owner.properties if parent else None
-    context = str(self.context) + '.' + action + '()'
+    values = [leaf.get(args) for leaf in leaves]
+    objects = []
+
+    for mask, table in partitions.items():
+      key = [value for value, set_ in zip(values, mask) if set_]
+
+      if None in key:
+        continue
 
-    while i < count:
       try:
-        cmd_args = self.format('{}/{}'.format(action, i), args)
-        err = None
-        break
+        objects.extend(table.get(tuple(key), ()))
+      except TypeError:
+        # Unhashable values never equal scalars
+        pass
+
+    return self.dispatch('bulk', objects, [args], callback, **opts)
+
+  def command(self, action:str, args:Mapping, quiet:bool=False) -> list:
+    """Formats the first command of `action` the arguments allow.
+
+    Returns the command and None, or None and the error of the last one.
+    """
+    err = None
+
+    for i in range(len(self.get(action))):
+      try:
+        return [self.format('{}/{}'.format(action, i), args), None]
       except PatternError as e:
-        print(e)
-        err = e
-        i += 1
+        if not quiet:
+          print(e)
 
-    if err:
-      count = 0
+        err = e
 
-      if fallback and self.get(fallback):
-        count = self.execute(fallback, filters, lambda _: self.execute(action, merge({}, filters, props.heritage(_)), callback))
-      elif parent:
-        count = parent.list(filters, lambda _: self.execute(action, merge({}, filters, pprops.heritage(_)), callback))
+    return [None, err]
 
-      if count > 0:
-        return count
+  def describe(self, filters:Mapping, callback, **opts) -> int:
+    return self.execute('describe', filters, callback, fallback='list', **opts)
 
-      pprint({context + '.arguments': args})
-      raise err
+  def dispatch(self, action:str, settings, batch:list, callback, seen:set=None, force:bool=False) -> int:
+    """Calls back with the remote objects matching any of the filters in `batch`.
 
-    cmd = joincmd(cmd_args)
+    `batch` lists initialized filters sharing the same command, and so the same
+    heritage. Objects matching several filters are only called back once, and
+    not at all if already in `seen`. Returns the number of objects called back.
+    """
+    parent = self.parent
+    props = self.owner.properties
+    pprops = parent.owner.properties if parent else None
+    context = str(self.context) + '.' + action + '()'
 
-    if self.cache and self.cache.cmd == cmd:
-      settings = self.cache.settings
-      print('$', cmd, '(cached)')
-    else:
-      secho('$ {}'.format(cmd), bold=True)
-      settings = loadyaml(check_output(cmd_args), Loader=FullLoader)
-      self.cache = self.Chache(cmd, settings)
+    if isinstance(settings, Iterator):
+      first = next(settings, self)
+      settings = None if first is self else chain([first], settings)
 
     if not settings:
       print(context + ': No objects found.')
       return 0
 
-    if not isinstance(settings, list):
+    if not isinstance(settings, (list, Iterator)):
       settings = [settings]
 
-    filters = props(filters, defaults=False, slugs=False)
-    filters_ = props.remote(filters)
-    heritage = pprops.heritage(filters) if self.parent else {}
+    heritage = pprops.heritage(batch[0]) if parent else {}
+    filters_ = [props.remote(_) for _ in batch]
+
+    # Objects get the shard they were listed from, unless synced
+    shard = {_: batch[0][_] for _ in self.shards if batch[0].get(_) is not None}
+
+    if shard:
+      heritage = merge(heritage, shard, cow=True)
+    counts = [0] * len(batch)
 
     count = 0
     condition = self.when
+    # The parent index, built when first needed (see inventory)
+    lookup = []
 
-    for args in settings:
-      args = props.sync(args)
-      args = merge(merge({}, heritage), args, clone=False)
-      args_ = props(args, defaults=False, slugs=False)
+    if len(filters_) == 1:
+      before, after = props.pushdown(filters_[0])
+      after = [after] if after else []
+    else:
+      before, after = None, filters_
 
-      if filters_:
-        if not match(args_, filters_, literally=True):
-          continue
+    before = compile_match(before, literally=True) if before else None
+    index = compile_index(after) if any(after) else None
 
-      if condition and not opts.get('force', False):
-        if isinstance(condition, str):
-          try:
-            if not jinja.compile_expression(condition)(**args):
-              continue
-          except Exception as e:
-            raise Error(str(self.context / 'when'), *e.args)
-        elif not match(args, condition):
+    if condition and not isinstance(condition, str) and self.matcher is None:
+      self.matcher = compile_match(condition)
+
+    def where(args):
+      # Rejects objects before init, when it can be told from synced values
+      if before and not before(args):
+        return False
+
+      if not condition or force:
+        return True
+
+      if not isinstance(condition, str):
+        return self.matcher(args)
+
+      try:
+        return bool(compile_expression(condition)(args))
+      except Exception:
+        # Raised again below, in order
+        return True
+
+    if isinstance(settings, list):
+      batches = [settings]
+    else:
+      batches = iter(lambda: list(islice(settings, self.batch_size)), [])
+
+    # Nothing before filtering has side effects, so the whole batch is projected
+    # at once, and errors raised in order
+    for row in chain.from_iterable(props.project(_, heritage, where) for _ in batches):
+      if row is None:
+        continue
+
+      if isinstance(row, Exception):
+        raise row
+
+      args, args_ = row
+      matches = index(args_) if index else range(len(batch))
+
+      if not matches:
+        continue
+
+      if condition and not force and isinstance(condition, str):
+        try:
+          if not compile_expression(condition)(args):
+            continue
+        except Exception as e:
+          raise Error(str(self.context / 'when'), *e.args)
+
+      for i in matches:
+        counts[i] += 1
+
+      if seen is not None:
+        key = tojson(args, sort_keys=True, default=str)
+
+        if key in seen:
           continue
 
+        seen.add(key)
+
       if parent:
         required = set()
         pprops.primarykey(args_, required=required)
@@ -191,7 +287,22 @@ class Sync(Method):
           required.clear()
           print(self.owner.name + ".primary_key:", props.primarykey(args_, required=required))
           print(self.owner.name + ": Missing argument:", ', '.join(required))
-          _ = parent.list(pprops.heritage(args), lambda _: callback(merge(pprops.heritage(_), args, clone=False)))
+          parents = None
+
+          if self.join:
+            if not lookup:
+              lookup.append(self.inventory())
+
+            if lookup[0]:
+              parents = lookup[0](pprops.heritage(args))
+
+          if parents is None:
+            _ = parent.list(pprops.heritage(args), lambda _: callback(merge(pprops.heritage(_), args, clone=False)))
+          else:
+            for _ in parents:
+              callback(merge(pprops.heritage(_), args, clone=False))
+
+            _ = len(parents)
 
           if _ > 0:
             count += _
@@ -202,12 +313,477 @@ class Sync(Method):
       callback(args)
       count += 1
 
-    if count == 0:
-      ctx = str(self.context)
+    ctx = str(self.context)
+
+    for i in range(len(batch)):
+      if counts[i]:
+        continue
 
-      if filters_:
-        print('{}.{}(): No matches for the given filter: {}'.format(ctx, action, tojson(filters_)))
+      if filters_[i]:
+        print('{}.{}(): No matches for the given filter: {}'.format(ctx, action, tojson(filters_[i])))
       else:
         print('{}/when: No matches for the given expression: {}'.format(ctx, condition))
 
     return count
+
+  def execute(self, action:str, filters:Mapping, callback, fallback:str=None, **opts) -> int:
+    batch = self.shard(filters)
+
+    if len(batch) > 1:
+      return self.execute_all(action, batch, callback, fallback, **opts)
+
+    parent = self.parent
+    format_specs = self.get(action)
+
+    if not format_specs and fallback:
+      format_specs = self.get(fallback)
+      action = fallback
+      fallback = None
+
+    if not format_specs:
+      return parent.list(filters, callback) if parent else 0
+
+    props = self.owner.properties
+    args = props(filters, defaults=False, slugs=False)
+    pprops = parent.owner.properties if parent else None
+    context = str(self.context) + '.' + action + '()'
+    cmd_args, err = self.command(action, args)
+
+    if err:
+      count = 0
+      # Run for all the objects found at once, so commands overlap
+      batch = []
+
+      if fallback and self.get(fallback):
+        count = self.execute(fallback, filters, lambda _: batch.append(merge(filters, props.heritage(_), cow=True)))
+      elif parent:
+        count = parent.list(filters, lambda _: batch.append(merge(filters, pprops.heritage(_), cow=True)))
+
+      if batch:
+        self.execute_all(action, batch, callback)
+
+      if count > 0:
+        return count
+
+      pprint({context + '.arguments': args})
+      raise err
+
+    return self.dispatch(action, self.run(cmd_args), [args], callback, **opts)
+
+  def execute_all(self, action:str, batch:list, callback, fallback:str=None, **opts) -> int:
+    """Same as execute for each of the filters in `batch`, but at once.
+
+    Filters resolving to the same command (and heritage) share a single run of
+    it, and its output is matched against all of them in one pass (see
+    dispatch). Each object is called back once, whichever filters it matches.
+
+    Up to `concurrency` distinct commands run ahead (see prefetch), while the
+    output of each one is dispatched in order.
+    """
+    parent = self.parent
+    format_specs = self.get(action)
+
+    if not format_specs and fallback:
+      format_specs = self.get(fallback)
+      action = fallback
+      fallback = None
+
+    batch = [_ for filters in batch for _ in self.shard(filters)]
+
+    if not format_specs:
+      return parent.execute_all('list', batch, callback, fallback='describe') if parent else 0
+
+    props = self.owner.properties
+    pprops = parent.owner.properties if parent else None
+    groups = {}
+    count = 0
+
+    def group(batch):
+      # Groups the filters by command, returning those it cannot be formatted for
+      unresolved = []
+
+      for filters in batch:
+        args = props(filters, defaults=False, slugs=False)
+        # Reported by expand, if not resolved
+        cmd_args, err = self.command(action, args, quiet=True)
+
+        if cmd_args is None:
+          unresolved.append(filters)
+          continue
+
+        heritage = pprops.heritage(args) if parent else {}
+        key = (joincmd(cmd_args), tojson(heritage, sort_keys=True, default=str))
+        groups.setdefault(key, [cmd_args, []])[1].append(args)
+
+      return unresolved
+
+    unresolved = group(batch)
+
+    # Resolved through other commands, for all the filters at once: the
+    # fallback, then the parent's list, and the few left one at a time
+    for fallback in [fallback, None] if fallback else [None]:
+      if unresolved:
+        unresolved = group(self.expand(action, unresolved, fallback))
+
+    for filters in unresolved:
+      count += self.execute(action, filters, callback, **opts)
+
+    seen = set()
+    groups = list(groups.values())
+    futures = {}
+    # At least the command dispatched next
+    ahead = max(1, int(self.concurrency or 1))
+
+    for i, (cmd_args, group) in enumerate(groups):
+      for j in range(i, min(i + ahead, len(groups))):
+        if j not in futures:
+          futures[j] = self.prefetch(groups[j][0])
+
+      count += self.dispatch(action, self.run(cmd_args, futures.pop(i)), group, callback, seen=seen, **opts)
+
+    return count
+
+  def expand(self, action:str, batch:list, fallback:str=None) -> list:
+    """Resolves the arguments the `action` command lacks for the filters in
+    `batch`, out of the objects `fallback` (or the parent's list) finds for all
+    of them in one pass.
+
+    Returns each filter merged with the heritage of every object matching it,
+    or raises the error of the first filter matching none.
+    """
+    parent = self.parent
+    props = self.owner.properties
+    context = str(self.context) + '.' + action + '()'
+    errors = []
+
+    for filters in batch:
+      args = props(filters, defaults=False, slugs=False)
+      errors.append([args, self.command(action, args)[1]])
+
+    source = props
+    found = []
+
+    if fallback and self.get(fallback):
+      self.execute_all(fallback, batch, found.append)
+    elif parent:
+      source = parent.owner.properties
+      parent.execute_all('list', batch, found.append, fallback='describe')
+
+    index = compile_index([source.remote(source(_, defaults=False, slugs=False)) for _ in batch])
+    counts = [0] * len(batch)
+    expanded = []
+
+    for _ in found:
+      heritage = source.heritage(_)
+
+      for i in index(source(_, defaults=False, slugs=False)):
+        counts[i] += 1
+        expanded.append(merge(batch[i], heritage, cow=True))
+
+    for i, (args, err) in enumerate(errors):
+      if not counts[i]:
+        pprint({context + '.arguments': args})
+        raise err
+
+    return expanded
+
+  def fetch(self, cmd_args:list, future=None):
+    """Runs a command, returning its parsed output, cached by the whole process.
+
+    `future` is the parsed output of the command, if prefetched (see prefetch).
+    """
+    cmd = joincmd(cmd_args)
+
+    if future is not None:
+      secho('$ {}'.format(cmd), bold=True)
+      return future.result()
+
+    def run():
+      store = commands.store
+      output = store.load(cmd_args) if store else None
+
+      if output is None:
+        secho('$ {}'.format(cmd), bold=True)
+        return self.output(cmd_args)
+
+      print('$', cmd, '(cached on disk)')
+      return [loads(output), len(output)]
+
+    settings, cached = commands.run(cmd_args, run)
+
+    if cached:
+      print('$', cmd, '(cached)')
+
+    return settings
+
+  def inventory(self):
+    """Lists all the parent objects, returning a function looking them up.
+
+    The function returns the parent objects `parent.list(filters)` would call
+    back, by hash on the values of the filters, or None when they are not all
+    scalars. Returns None if the parents cannot be listed without filters.
+    """
+    pprops = self.parent.owner.properties
+    objects = []
+
+    try:
+      self.parent.list({}, objects.append)
+    except RequiredArgument:
+      return None
+
+    rows = [[_, pprops(_, defaults=False, slugs=False)] for _ in objects]
+    tables = {}
+
+    def lookup(filters:Mapping):
+      filters = pprops.remote(pprops(filters, defaults=False, slugs=False))
+
+      if not all(type(_) in scalar_types for _ in filters.values()):
+        return None
+
+      keys = tuple(sorted(filters))
+      table = tables.get(keys)
+
+      if table is None:
+        getters = [getter(_) for _ in keys]
+        table = tables[keys] = {}
+
+        for args, args_ in rows:
+          try:
+            table.setdefault(tuple(_(args_) for _ in getters), []).append(args)
+          except TypeError:
+            # Unhashable values never equal scalars
+            pass
+
+      return table.get(tuple(filters[_] for _ in keys), [])
+
+    return lookup
+
+  def list(self, filters:Mapping, callback, **opts) -> int:
+    return self.execute('list', filters, callback, fallback='describe', **opts)
+
+  def output(self, cmd_args:list) -> list:
+    """Runs a command, returning its parsed output and size, saved on disk if
+    `commands.store` is set."""
+    output = runner.run(cmd_args, self.policy())
+    store = commands.store
+
+    if store:
+      store.save(cmd_args, output)
+
+    return [loads(output), len(output)]
+
+  def paginate(self, cmd_args:list, future=None) -> Iterator:
+    """Fetches the first page of output, returning an iterator over the objects
+    of all pages.
+
+    The objects of each page are at the `paginate/items` path, if any, and the
+    next page is fetched by passing the token at the `paginate/token` path as
+    `paginate/argument`, while the objects of the previous one are processed.
+    """
+    context = str(self.context / 'paginate')
+    items = self.get('paginate/items')
+    items = getter(items) if items else None
+
+    if not self.get('paginate/token'):
+      raise Required(context, 'token')
+
+    if not self.get('paginate/argument'):
+      raise Required(context, 'argument')
+
+    token = getter(self.get('paginate/token'))
+    argument = self.get('paginate/argument')
+
+    def objects(page):
+      page = items(page) if items else page
+      return page if isinstance(page, list) else [] if page is None else [page]
+
+    def pages(page):
+      while True:
+        next_ = token(page)
+
+        if next_:
+          next_ = cmd_args + [argument, str(next_)]
+          future = self.prefetch(next_)
+
+        yield from objects(page)
+
+        if not next_:
+          return
+
+        page = self.fetch(next_, future)
+
+    return pages(self.fetch(cmd_args, future))
+
+  def partition(self, settings) -> dict:
+    """Groups remote objects by the values of the parent's inherited
+    properties they sync, first by which of them they sync (see bulk).
+
+    Values are those of initialized objects, as are the filters they are
+    looked up with.
+    """
+    props = self.owner.properties
+    leaves = self.parent.owner.properties.leaves[1]
+    partitions = {}
+
+    if settings is None:
+      settings = []
+    elif isinstance(settings, Mapping):
+      settings = [settings]
+    else:
+      settings = list(settings)
+
+    for _, row in zip(settings, props.project(settings)):
+      # Left out, as when syncing none
+      if not isinstance(row, list):
+        continue
+
+      values = [leaf.get(row[1]) for leaf in leaves]
+      mask = tuple(value is not None for value in values)
+
+      if not any(mask):
+        continue
+
+      try:
+        partitions.setdefault(mask, {}).setdefault(tuple(value for value in values if value is not None), []).append(_)
+      except TypeError:
+        pass
+
+    return partitions
+
+  def policy(self) -> Retry:
+    """The retry policy of commands, from `retry`, if any (see Retry)."""
+    cfg = self.get('retry')
+
+    if not cfg:
+      return None
+
+    if self.retry is None:
+      cfg = {} if cfg is True else cfg
+      codes = cfg.get('codes')
+      patterns = cfg.get('patterns')
+
+      self.retry = Retry(
+        attempts=cfg.get('attempts', 3),
+        codes=[codes] if isinstance(codes, int) else codes,
+        patterns=[patterns] if isinstance(patterns, str) else patterns,
+        delay=cfg.get('delay', 1),
+        max_delay=cfg.get('max_delay', 30),
+      )
+
+    return self.retry
+
+  def prefetch(self, cmd_args:list):
+    """Starts running a command ahead of fetch, returning the future of its
+    parsed output, or None if cached, already running, or streamed (see run).
+
+    The run is shared with concurrent fetches of the same command, as any other
+    (see CommandCache.start).
+    """
+    store = commands.store
+
+    if self.get('stream') and not self.get('paginate'):
+      return None
+
+    if store and cmd_args in store:
+      return None
+
+    return commands.start(cmd_args, lambda: self.output(cmd_args))
+
+  def run(self, cmd_args:list, future=None):
+    """Runs a command, returning its parsed output.
+
+    With `paginate` or `stream`, returns an iterator over the objects in the
+    output instead (see paginate and stream).
+    """
+    if self.get('paginate'):
+      return self.paginate(cmd_args, future)
+
+    if self.get('stream'):
+      return self.stream(cmd_args)
+
+    return self.fetch(cmd_args, future)
+
+  def shard(self, filters:Mapping) -> list:
+    """Fans `filters` out into one per combination of `shards` values.
+
+    Shards are arguments, such as a region, mapped to the list of values to
+    run commands for, unless set by `filters`.
+    """
+    batch = [filters]
+
+    for key, values in self.shards.items():
+      if filters and filters.get(key) is not None:
+        continue
+
+      if not isinstance(values, list):
+        values = [values]
+
+      batch = [merge(_, {key: value}, cow=True) for _ in batch for value in values]
+
+    return batch
+
+  def stream(self, cmd_args:list) -> Iterator:
+    """Runs a command, yielding the objects in its output as they are parsed.
+
+    The output is a JSON array, the one at the `stream` path when not true, or
+    a stream of JSON documents (see iterjson). The command is killed if the
+    objects are not all consumed.
+
+    Failures are retried as `retry` says (see policy), but only before any
+    object is yielded. The command does not count against the runner's limit,
+    as it runs while its objects are synced, which may run other commands.
+    """
+    path = self.get('stream')
+    path = path.split('/') if isinstance(path, str) else None
+    retry = self.policy()
+    attempt = 0
+
+    while True:
+      attempt += 1
+      secho('$ {}'.format(joincmd(cmd_args)), bold=True)
+      yielded = False
+      error = None
+      done = False
+
+      # A file rather than a pipe, which could fill up while stdout is read
+      with TemporaryFile() if retry else nullcontext() as stderr:
+        proc = Popen(cmd_args, stdout=PIPE, stderr=stderr)
+
+        try:
+          try:
+            for _ in iterjson(proc.stdout, path):
+              yielded = True
+              yield _
+          except ValueError as e:
+            error = Error(str(self.context / 'stream'), joincmd(cmd_args), *e.args)
+
+          # Whatever follows is not needed, but the command may block writing it
+          while proc.stdout.read(1 << 16):
+            pass
+
+          done = True
+        finally:
+          if not done:
+            proc.kill()
+
+          proc.stdout.close()
+          retcode = proc.wait()
+
+        if stderr is not None:
+          stderr.seek(0)
+          errors = stderr.read()
+          sys.stderr.buffer.write(errors)
+          sys.stderr.flush()
+
+      if retcode and retry and not yielded and attempt < retry.attempts and retry.match(retcode, errors):
+        sleep(retry.report(cmd_args, retcode, attempt))
+        continue
+
+      # A failed command is the likely cause of invalid output
+      if retcode:
+        raise CalledProcessError(retcode, cmd_args)
+
+      if error:
+        raise error
+
+      return
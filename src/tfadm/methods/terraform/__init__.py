@@ -1,8 +1,15 @@
 from .. import ExternalCommand, Group
+from ...cache import documents
 from collections.abc import Mapping
+from threading import local
+
+# The working directory is per thread, as resources may sync concurrently
+context = local()
 
 class Command(ExternalCommand):
   def __call__(self, *args) -> list:
+    # Terraform reads the files, so write any pending changes first
+    documents.flush()
     return super().__call__(*args)
 
   def args(self, *args) -> list:
@@ -16,9 +23,13 @@ class Command(ExternalCommand):
 
     return this
 
+  @property
+  def cwd(self):
+    return getattr(context, 'cwd', None)
+
   @classmethod
   def chdir(cls, path):
-    cls.cwd = path
+    context.cwd = path
     return path
 
 class Terraform(Group):
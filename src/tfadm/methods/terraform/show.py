@@ -1,7 +1,7 @@
 from . import Command
+from ...parsers import loads
 from ...settings import get, Descriptor
 from collections.abc import Mapping
-from json import loads as loadjson
 from subprocess import check_output
 
 class Show(Command):
@@ -12,7 +12,7 @@ class Show(Command):
 
   def __call__(self, *args) -> Mapping:
     this = super().__call__('-json', '-no-color', *args)
-    state = get(loadjson(check_output(this)), self.resources, [])
+    state = get(loads(check_output(this), json=True), self.resources, [])
     return self.owner.state.update({self.cwd: state})
 
   def _inherit(self):
@@ -1,6 +1,7 @@
 from . import Method
+from ..cache import documents
 from ..exceptions import RequiredArgument
-from ..settings import match, merge, pop, pprint, Settings
+from ..settings import compile_match, detach, merge, pop, pprint, unshare, Settings
 from collections.abc import Mapping, ValuesView
 from json import dumps as tojson
 from os.path import dirname
@@ -37,130 +38,141 @@ class Update(Method):
       pprint({context + '.primary_key': pk})
       raise e
 
-    try:
-      terraform = resource.load(source)
-      init = False
-    except FileNotFoundError:
-      terraform = Settings()
-      init = True
+    with documents.lock(source):
+      try:
+        terraform = documents.load(source)
+        init = False
+      except FileNotFoundError:
+        terraform = Settings()
+        init = True
 
-    try:
-      # Resolve the item's address within Terraform
-      address = resource.format('address', args_)
-    except Exception as e:
-      pprint({context + '.arguments': args_})
-      raise e
+      try:
+        # Resolve the item's address within Terraform
+        address = resource.format('address', args_)
+      except Exception as e:
+        pprint({context + '.arguments': args_})
+        raise e
 
-    # Control variable to know if it is creating or updating the resource
-    settings = None
+      # Control variable to know if it is creating or updating the resource
+      settings = None
 
-    if terraform:
-      items = terraform.get(address)
+      if terraform:
+        items = terraform.get(address)
+        path = address
 
-      if items is None and address != resource.address:
-        address_ = dirname(address)
+        if items is None and address != resource.address:
+          address_ = dirname(address)
 
-        if address_ != '':
-          items = terraform.get(address_)
+          if address_ != '':
+            items = terraform.get(address_)
+            path = address_
 
-          if isinstance(items, Mapping):
-            items = items.values()
+            if isinstance(items, Mapping):
+              items = items.values()
 
-      if isinstance(items, (list, ValuesView)):
-        # Using primary key to match items
-        settings_ = props.tosettings(pk_, defaults=False)
+        if isinstance(items, (list, ValuesView)):
+          # Using primary key to match items
+          settings_ = props.tosettings(pk_, defaults=False)
 
-        if settings_:
-          for _ in items:
+          if settings_:
             # Exact match, no wildcards
-            if match(_, settings_, literally=True, default=True):
-              settings = _
-              break
-      else:
-        settings = items
+            matcher = compile_match(settings_, literally=True, default=True)
 
-      # Discard old settings if `overwrite` option is enabled
-      if isinstance(settings, Mapping) and overwrite:
-        settings.clear()
+            for _ in items:
+              if matcher(_):
+                settings = _
+                break
+        else:
+          settings = items
 
-    if settings:
-      if defaults:
-        raise FileExistsError(errno.EEXIST, '{}: Object already exists'.format(resource.name), tojson(pk))
-      exists = True
-    else:
-      exists = False
+        if isinstance(settings, Mapping):
+          # Changed in place, while the document is shared with the cache
+          settings = detach(terraform.data, path, settings)
 
-    # Generate the template
-    template = resource.template(args_)
-    terraform.merge((template.copy() if dry_run else template), extend=True, clone=False)
+          # Discard old settings if `overwrite` option is enabled
+          if overwrite:
+            settings.clear()
 
-    try:
-      if exists:
-        settings_ = props.tosettings(args_, defaults=False)
-        merge(settings, settings_, extend=True, clone=False)
-        action = 'Updated'
-        created = False
+      if settings:
+        if defaults:
+          raise FileExistsError(errno.EEXIST, '{}: Object already exists'.format(resource.name), tojson(pk))
+        exists = True
       else:
-        if not defaults:
-          args_ = props(args)
+        exists = False
 
-        try:
-          # Convert arguments to settings and validates the request as well
-          settings_ = props.tosettings(args_)
-        except ValueError as e:
-          raise RequiredArgument(resource.name, *e.args)
-
-        if settings is None:
-          settings = settings_
-          terraform.merge(Settings().update({address: settings}), extend=True, clone=False)
-          action = 'Created'
+      # Generate the template
+      template = resource.template(args_)
+      terraform.merge((template.copy() if dry_run else template), extend=True, cow=True)
+
+      try:
+        if exists:
+          settings_ = props.tosettings(args_, defaults=False)
+          merge(settings, settings_, extend=True, clone=False)
+          action = 'Updated'
+          created = False
         else:
-          merge(settings, settings_, clone=False)
-          action = 'Overwritten'
+          if not defaults:
+            args_ = props(args)
+
+          try:
+            # Convert arguments to settings and validates the request as well
+            settings_ = props.tosettings(args_)
+          except ValueError as e:
+            raise RequiredArgument(resource.name, *e.args)
+
+          if settings is None:
+            settings = settings_
+            terraform.merge(Settings().update({address: settings}), extend=True, cow=True)
+            action = 'Created'
+          else:
+            merge(settings, settings_, clone=False)
+            action = 'Overwritten'
+
+          created = True
+      except Exception as e:
+        pprint({context + '.arguments': args_})
+        raise e
 
-        created = True
-    except Exception as e:
-      pprint({context + '.arguments': args_})
-      raise e
+      conflicts_with = resource.conflicts_with
 
-    conflicts_with = resource.conflicts_with
+      if conflicts_with:
+        if isinstance(conflicts_with, str):
+          conflicts_with = [conflicts_with]
 
-    if conflicts_with:
-      if isinstance(conflicts_with, str):
-        conflicts_with = [conflicts_with]
+        for key in conflicts_with:
+          unshare(terraform.data, key)
+          terraform.pop(key)
 
-      for key in conflicts_with:
-        terraform.pop(key)
+      if dry_run:
+        settings = settings_
 
-    if dry_run:
-      settings = settings_
+      try:
+        resource.beforesave(settings)
+      except Exception as e:
+        pprint({context + '.settings': settings})
+        raise e
 
-    try:
-      resource.beforesave(settings)
-    except Exception as e:
-      pprint({context + '.settings': settings})
-      raise e
+      if not dry_run:
+        try:
+            source_dir = source.parent
+            source_dir.mkdir(parents=True, exist_ok=False)
+            print(context + ': mkdir', str(source_dir))
+        except FileExistsError:
+          pass
 
-    if not dry_run:
-      try:
-          source_dir = source.parent
-          source_dir.mkdir(parents=True, exist_ok=False)
-          print(context + ': mkdir', str(source_dir))
-      except FileExistsError:
-        pass
+      if terraform:
+        if dry_run:
+          template.merge(Settings().update({address: settings}), extend=True, clone=False).print(explicit_start=True, sort_keys=True)
+          print('---')
+        else:
+          # Save the new Terraform to the file
+          documents.dump(str(source), terraform, sort_keys=True)
 
     if terraform:
-      if dry_run:
-        template.merge(Settings().update({address: settings}), extend=True, clone=False).print(explicit_start=True, sort_keys=True)
-        print('---')
-      else:
-        # Save the new Terraform to the file
-        resource.dump(str(source), terraform, sort_keys=True)
-
       print(context + ':', action, source, address)
 
       heritage = props.heritage(args_)
-      _ = merge({}, args, heritage)
+      _ = merge(args, heritage, cow=True)
 
       if init:
         resource.trigger('init', _, overwrite=overwrite, dry_run=dry_run)
@@ -188,37 +200,41 @@ class Update(Method):
         pprint({context + '.arguments': args_})
         raise e
 
-      # Load the current Terraform, if exists
-      try:
-        terraform = resource.module.load(str(filename))
-      except FileNotFoundError:
-        terraform = Settings()
+      with documents.lock(filename):
+        # Load the current Terraform, if exists
+        try:
+          terraform = documents.load(str(filename))
+        except FileNotFoundError:
+          terraform = Settings()
 
-      settings = terraform.get(address)
+        settings = terraform.get(address)
 
-      if settings:
-        if overwrite:
-          settings.clear()
-          action = 'Overwritten'
+        if settings:
+          if isinstance(settings, Mapping):
+            settings = detach(terraform.data, address, settings)
+
+          if overwrite:
+            settings.clear()
+            action = 'Overwritten'
+          else:
+            action = 'Updated'
         else:
-          action = 'Updated'
-      else:
-        action = 'Created'
+          action = 'Created'
 
-      terraform_ = Settings().update({address: settings_})
+        terraform_ = Settings().update({address: settings_})
 
-      if dry_run:
-        # Only print the object that would be saved, without saving it.
-        terraform_.print(explicit_start=True, sort_keys=True)
-        print('---')
-      else:
-        try:
-          filename.parent.mkdir(parents=True, exist_ok=False)
-          print(context + ': mkdir', str(filename.parent))
-        except FileExistsError:
-          pass
+        if dry_run:
+          # Only print the object that would be saved, without saving it.
+          terraform_.print(explicit_start=True, sort_keys=True)
+          print('---')
+        else:
+          try:
+            filename.parent.mkdir(parents=True, exist_ok=False)
+            print(context + ': mkdir', str(filename.parent))
+          except FileExistsError:
+            pass
 
-        resource.module.dump(str(filename), terraform.merge(terraform_, clone=False), sort_keys=True)
+          documents.dump(str(filename), terraform.merge(terraform_, cow=True), sort_keys=True)
 
       print(context + ':', action, str(filename), address)
 
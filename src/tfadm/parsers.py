@@ -0,0 +1,231 @@
+from codecs import getincrementaldecoder
+from collections import UserDict, UserList
+from json import JSONDecoder, dump as dump_json
+from pathlib import PurePath
+import re
+import yaml
+
+try:
+  from orjson import loads as _loads_json
+except ImportError:
+  from json import loads as _loads_json
+
+try:
+  from yaml import CSafeLoader as Loader, CSafeDumper as _Dumper
+except ImportError:
+  from yaml import SafeLoader as Loader, SafeDumper as _Dumper
+
+class Dumper(_Dumper):
+  # Shared objects are dumped in full, never as anchors and aliases
+  def ignore_aliases(self, data):
+    return True
+
+Dumper.add_multi_representer(UserDict, lambda dumper, data: dumper.represent_dict(data.data))
+Dumper.add_multi_representer(UserList, lambda dumper, data: dumper.represent_list(data.data))
+Dumper.add_multi_representer(PurePath, lambda dumper, data: dumper.represent_str(str(data)))
+Dumper.add_representer(tuple, lambda dumper, data: dumper.represent_list(data))
+Dumper.add_representer(set, lambda dumper, data: dumper.represent_list(sorted(data, key=str)))
+
+class JSONStream:
+  """Incremental JSON scanner over a binary stream, read chunk by chunk.
+
+  Only the unconsumed part of the input is buffered, so values are parsed as
+  soon as they are complete.
+  """
+  whitespace = re.compile(r'[ \t\n\r]*')
+  numeric = frozenset('+-.0123456789Ee')
+
+  def __init__(self, fp, chunk_size:int=1 << 16):
+    self.read_ = getattr(fp, 'read1', fp.read)
+    self.chunk_size = chunk_size
+    self.decoder = JSONDecoder()
+    self.utf8 = getincrementaldecoder('utf-8')()
+    self.text = ''
+    self.pos = 0
+    self.offset = 0
+    self.eof = False
+
+  def error(self, msg:str, pos:int=None) -> ValueError:
+    return ValueError('{}: char {}'.format(msg, self.offset + (self.pos if pos is None else pos)))
+
+  def expect(self, chars:str) -> str:
+    """Consumes the next character, which must be one of `chars`."""
+    c = self.peek()
+
+    if not c or c not in chars:
+      raise self.error('Expecting ' + ' or '.join(repr(_) for _ in chars))
+
+    self.pos += 1
+    return c
+
+  def peek(self) -> str:
+    """Skips whitespace, returning the next character, or '' at the end."""
+    while True:
+      self.pos = self.whitespace.match(self.text, self.pos).end()
+
+      if self.pos < len(self.text):
+        return self.text[self.pos]
+
+      if not self.read():
+        return ''
+
+  def read(self, size:int=None) -> bool:
+    """Buffers the next chunk of input, returning false at the end of it."""
+    if self.eof:
+      return False
+
+    chunk = self.read_(size or self.chunk_size)
+    self.eof = not chunk
+    self.offset += self.pos
+    self.text = self.text[self.pos:] + self.utf8.decode(chunk, final=self.eof)
+    self.pos = 0
+    return True
+
+  def value(self):
+    """Parses the next value, reading as much input as needed."""
+    self.peek()
+    size = self.chunk_size
+
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.text, self.pos)
+      except ValueError as e:
+        if not self.read(size):
+          raise self.error(getattr(e, 'msg', str(e)), getattr(e, 'pos', None))
+
+        # Parsed again from the start, so larger values read larger chunks
+        size *= 2
+        continue
+
+      # Numbers may go on in the next chunk, even if they parsed short of it
+      if type(value) in (int, float) and (end == len(self.text) or self.text[end] in self.numeric) and self.read():
+        continue
+
+      self.pos = end
+      return value
+
+def iterjson(fp, path:list=None):
+  """Yields the items of a JSON array read from binary `fp`, as parsed.
+
+  The array is the whole document, or the value of `path` (a list of keys)
+  within it, the rest of the input being left unread. Any other input is read
+  as a stream of JSON documents, such as NDJSON, each one being yielded.
+  """
+  stream = JSONStream(fp)
+
+  for key in path or []:
+    stream.expect('{')
+
+    if stream.peek() == '}':
+      return
+
+    while True:
+      name = stream.value()
+      stream.expect(':')
+
+      if name == key:
+        break
+
+      stream.value()
+
+      if stream.expect(',}') == '}':
+        return
+
+  if path or stream.peek() == '[':
+    stream.expect('[')
+
+    if stream.peek() == ']':
+      return
+
+    while True:
+      yield stream.value()
+
+      if stream.expect(',]') == ']':
+        return
+
+  while stream.peek():
+    yield stream.value()
+
+def isjson(text) -> bool:
+  """Whether `text` looks like a JSON document, rather than YAML."""
+  if isinstance(text, (bytes, bytearray)):
+    text = text.lstrip()[0:1].decode()
+  else:
+    text = text.lstrip()[0:1]
+
+  return text in ('{', '[', '"')
+
+def loads(text, json:bool=None):
+  """Parses a JSON or YAML document.
+
+  JSON is tried first when `json` is true, or when not given and the content
+  looks like JSON, falling back to YAML, which is a superset of it.
+  """
+  if json is None:
+    json = isjson(text)
+
+  if json:
+    try:
+      return _loads_json(text)
+    except ValueError:
+      pass
+
+  return yaml.load(text, Loader=Loader)
+
+def loads_all(text) -> list:
+  """Parses a stream of JSON or YAML documents."""
+  if isinstance(text, (bytes, bytearray)):
+    text = text.decode()
+
+  if isjson(text):
+    decoder = JSONDecoder()
+    docs = []
+    i = 0
+    end = len(text)
+
+    try:
+      while True:
+        while i < end and text[i].isspace():
+          i += 1
+
+        if i == end:
+          return docs
+
+        doc, i = decoder.raw_decode(text, i)
+        docs.append(doc)
+    except ValueError:
+      pass
+
+  return [_ for _ in yaml.load_all(text, Loader=Loader)]
+
+def load(fp, json:bool=None):
+  return loads(fp.read(), json)
+
+def load_all(fp) -> list:
+  return loads_all(fp.read())
+
+def dump(data, fp, json:bool=False, **opts):
+  if json:
+    opts.setdefault('indent', 2)
+    opts.setdefault('default', tojsonable)
+    dump_json(data, fp, **opts)
+    print(file=fp)
+  else:
+    dump_yaml(data, stream=fp, **opts)
+
+def dump_yaml(data, **opts):
+  opts.setdefault('Dumper', Dumper)
+  return yaml.dump(data, **opts)
+
+def tojsonable(value):
+  """`default` hook for the JSON encoder, for non built-in containers."""
+  if isinstance(value, (UserDict, UserList)):
+    return value.data
+
+  if isinstance(value, PurePath):
+    return str(value)
+
+  if isinstance(value, set):
+    return list(value)
+
+  raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
@@ -1,7 +1,7 @@
 from .exceptions import Error, PatternError
-from .settings import get, getformat, merge, update, pop
-from .template import jinja
-from collections import UserDict
+from .settings import clone, format_map, get, getter, merge, update, pop, setter, unshare, vformat
+from .template import compile_expression
+from collections import ChainMap, UserDict
 from collections.abc import Mapping
 from json import dumps as json_encode, loads as json_decode
 from os.path import dirname
@@ -13,67 +13,193 @@ import re
 
 slugify_regex = r'[^-a-zA-Z0-9_]+'
 
-def compute(prop:Mapping, value, args:Mapping):
-  if value is not None:
-    type_ = prop.get('type')
+class Step:
+  """A property, with its settings resolved for init, tosettings and sync.
 
-    if type_ in ['json', 'string'] and not isinstance(value, str):
-      value = json_encode(value)
+  Paths and expressions are compiled once, and applied to every row (see
+  init_batch and sync_batch).
+  """
+  __slots__ = (
+    'key', 'alias', 'use', 'sync', 'getters', 'when', 'ignore', 'primary_key',
+    'required', 'value', 'default', 'encode', 'islist', 'translate', 'expr',
+    'patterns', 'hash', 'format', 'computed', 'unset', 'plan', 'passthrough',
+  )
 
-  translator = prop.get('translate')
+  def __init__(self, key:str, prop:Mapping):
+    self.key = key
+    self.alias = prop.get('alias', key)
+    self.use = prop.get('use', key)
+    self.sync = sync = prop.get('sync', key)
 
-  if translator:
-    for v1, v2 in translator.items():
-      if value == v1:
-        value = v2
-        break
+    if sync is False:
+      self.getters = ()
+    else:
+      self.getters = tuple(getter(_) for _ in (sync if isinstance(sync, list) else [sync]))
 
-  expr = prop.get('expr')
+    self.when = compiled(prop.get('when'))
+    self.ignore = prop.get('ignore', False)
+    self.primary_key = prop.get('primary_key', False)
+    self.required = prop.get('required', False)
+    self.value = prop.get('value')
+    self.default = prop.get('default')
 
-  if expr:
-    try:
-      value = jinja.compile_expression(expr)(this=value, **args)
-    except Exception as e:
-      raise Error('expr', *e.args)
+    type_ = prop.get('type')
+    self.encode = type_ in ['json', 'string']
+    type_ = 'string' if type_ is None else type_
+    self.islist = type_ == 'list' or type_.startswith('list(')
 
-  if not isinstance(value, str):
-    return value
+    self.translate = prop.get('translate') or None
+    self.expr = compiled(prop.get('expr'))
 
-  patterns = prop.get('pattern')
+    patterns = prop.get('pattern') or []
 
-  if patterns:
     if not isinstance(patterns, list):
       patterns = [patterns]
 
-    for _ in patterns:
-      _ = re.compile(_).match(value)
+    self.patterns = tuple(re.compile(_) for _ in patterns)
+    self.hash = hasher(prop.get('hash'))
+    self.format = prop.get('format')
+    self.computed = prop.get('computed')
 
-      if _:
-        merge(args, _.groupdict({}))
-        break
+    unset = []
+
+    for item in prop.get('unset', []):
+      if isinstance(item, str):
+        unset.append((item, None))
+      else:
+        unset.append((item.get('key'), compiled(item.get('when'))))
+
+    self.unset = tuple(unset)
+
+    props = prop.get('properties')
+    self.plan = compile_plan(props) if props else None
+
+    # Whether init leaves the value as is, when given and without defaults
+    self.passthrough = not (
+      self.plan or self.value is not None or self.encode or self.translate or
+      self.expr or self.hash or self.format or self.unset
+    )
+
+def compiled(source:str):
+  """Compiles an expression, if any, deferring errors until evaluated."""
+  if not source:
+    return None
+
+  try:
+    return compile_expression(source)
+  except Exception as e:
+    def fail(*args, **kwds):
+      raise e
+
+    return fail
+
+def compile_plan(properties:Mapping) -> tuple:
+  """Compiles properties into a tuple of steps, in order."""
+  return tuple(Step(key, prop) for key, prop in properties.items())
 
-  algorithm = prop.get('hash')
+class Leaf:
+  """A property without nested properties, with its path resolved."""
+  __slots__ = ('alias', 'get', 'set', 'slug', 'when', 'base', 'required')
 
-  if algorithm:
-    value = value.encode()
-    fn = {"adler32": adler32, "crc32": crc32}.get(algorithm)
-    value = '{:x}'.format(fn(value) & 0xffffffff) if fn else hashlib.new(algorithm, value).hexdigest()
+  def __init__(self, alias:str, prop:Mapping, primary_key:bool=False):
+    self.alias = alias
+    self.get = getter(alias)
+    self.set = setter(alias)
+    self.slug = None
+    self.when = None
+    self.base = None
+    self.required = prop.get('required', True)
 
-  format_spec = prop.get('format')
+    # Only primary keys are conditional and have slugs
+    if primary_key:
+      self.slug = (getter(alias + '_'), setter(alias + '_'))
+      when = prop.get('when')
 
-  if format_spec:
+      if when:
+        self.when = compile_expression(when)
+        base = dirname(alias)
+        self.base = getter(base) if base else None
+
+def compile_leaves(properties:Mapping) -> tuple:
+  """Lists the primary key, inherited and synced leaves of properties."""
+  keys = []
+  heritable = []
+  remote = []
+
+  def callback(alias, prop):
+    primary_key = prop.get('primary_key', False)
+
+    if primary_key:
+      keys.append(Leaf(alias, prop, primary_key=True))
+
+    if prop.get('inherit', primary_key):
+      heritable.append(Leaf(alias, prop))
+
+    if prop.get('sync', True) != False:
+      remote.append(Leaf(alias, prop))
+
+  walk(properties, callback)
+
+  return (tuple(keys), tuple(heritable), tuple(remote))
+
+def hasher(algorithm:str):
+  """Returns a function hashing bytes into an hex digest, or None."""
+  if not algorithm:
+    return None
+
+  fn = {"adler32": adler32, "crc32": crc32}.get(algorithm)
+
+  if fn:
+    return lambda value: '{:x}'.format(fn(value) & 0xffffffff)
+
+  try:
+    proto = hashlib.new(algorithm)
+  except ValueError:
+    # Unsupported algorithms only fail when used
+    return lambda value: hashlib.new(algorithm, value).hexdigest()
+
+  def hexdigest(value):
+    _ = proto.copy()
+    _.update(value)
+    return _.hexdigest()
+
+  return hexdigest
+
+def compute(step:Step, value, args:Mapping):
+  if value is not None and step.encode and not isinstance(value, str):
+    value = json_encode(value)
+
+  if step.translate is not None:
     try:
-      value = format_spec.format(value, **args)
-    except KeyError as e:
-      raise KeyError('format', *e.args)
+      value = step.translate.get(value, value)
+    except TypeError:
+      # Unhashable values never match
+      pass
 
-  return value
+  if step.expr:
+    try:
+      value = step.expr(args, this=value)
+    except Exception as e:
+      raise Error('expr', *e.args)
 
-def getvalue(prop:Mapping, args:Mapping, key:str):
-  value = args.get(key)
+  if not isinstance(value, str):
+    return value
 
-  if value is None:
-    value = getformat(prop, 'value', args)
+  for pattern in step.patterns:
+    _ = pattern.match(value)
+
+    if _:
+      merge(args, _.groupdict({}))
+      break
+
+  if step.hash:
+    value = step.hash(value.encode())
+
+  if step.format:
+    try:
+      value = vformat(step.format, args, value)
+    except KeyError as e:
+      raise KeyError('format', *e.args)
 
   return value
 
@@ -106,101 +232,136 @@ def inherit(properties:Mapping):
 
   return inherited
 
-def init(properties:Mapping, args:Mapping, defaults:bool=True, slugs:bool=True, root:Mapping=None) -> Mapping:
+def init(plan:tuple, args:Mapping, defaults:bool=True, slugs:bool=True, root:Mapping=None) -> Mapping:
   if args is None:
     args = {}
 
   if root is None:
     root = args
 
-  args_ = {'_': root, **args}
+  # Arguments as seen by expressions: `args`, under a layer with the root and
+  # the groups matched by patterns
+  args_ = ChainMap({'_': root}, args)
 
-  for key, prop in properties.items():
-    condition = prop.get('when')
+  for step in plan:
+    _init(step, args, args_, defaults, slugs, root)
 
-    try:
-      if condition and not jinja.compile_expression(condition)(**args_):
-        continue
-    except Exception as e:
-      raise Error(key + '/when', *e.args)
+  return args
 
-    alias = prop.get('alias', key)
+def _init(step:Step, args:Mapping, args_:ChainMap, defaults:bool, slugs:bool, root:Mapping):
+  # One step of init, see init_batch
+  key = step.key
+  top = args_.maps[0]
+  condition = step.when
 
-    try:
-      value = getvalue(prop, args_, alias)
-    except:
-      value = None
+  try:
+    if condition and not condition(args_):
+      return
+  except Exception as e:
+    raise Error(key + '/when', *e.args)
 
-    props = prop.get('properties')
+  alias = step.alias
 
-    if props:
-      try:
-        value = merge(value, init(props, value, defaults, slugs, root), clone=False)
-      except KeyError as e:
-        raise KeyError(key, 'properties', *e.args)
-      except Error as e:
-        raise Error(key + '/properties/' + e.args[0], *e.args[1:])
+  try:
+    value = args_.get(alias)
 
-      if not value:
-        continue
-    else:
-      primary_key = prop.get('primary_key', False)
+    if value is None:
+      value = format_map(step.value, args_)
+  except:
+    value = None
 
-      if defaults and value is None:
-        try:
-          value = getformat(prop, 'default', args_)
-        except:
-          pass
+  if step.plan is not None:
+    if isinstance(value, Mapping):
+      # Copy on write, the value may be shared with the caller's arguments
+      shared = value is args_.get(alias)
+      value = {**value}
+
+      if shared:
+        args[alias] = value
+        top.pop(alias, None)
 
+    try:
+      value = merge(value, init(step.plan, value, defaults, slugs, root), clone=False)
+    except KeyError as e:
+      raise KeyError(key, 'properties', *e.args)
+    except Error as e:
+      raise Error(key + '/properties/' + e.args[0], *e.args[1:])
+
+    if not value:
+      return
+  else:
+    if defaults and value is None:
       try:
-        _ = compute(prop, value, args_)
-      except KeyError as e:
-        raise KeyError(key, *e.args)
-      except Error as e:
-        raise Error(key + '/' + e.args[0], *e.args[1:])
+        value = format_map(step.default, args_)
+      except:
+        pass
 
-      if _ is None:
-        if value is not None:
-          pop(args, alias)
-          pop(args_, alias)
+    try:
+      _ = compute(step, value, args_)
+    except KeyError as e:
+      raise KeyError(key, *e.args)
+    except Error as e:
+      raise Error(key + '/' + e.args[0], *e.args[1:])
 
-        continue
+    if _ is None:
+      if value is not None:
+        pop(unshare(args, alias), alias)
+        pop(unshare(top, alias), alias)
 
-      value = _
+      return
 
-      if slugs and primary_key:
-        alias_ = alias + '_'
-        value_ = fnslugify(str(value), lowercase=False, regex_pattern=slugify_regex)
-        args[alias_] = value_
-        args_[alias_] = value_
+    value = _
 
-    if isinstance(value, Mapping):
-      unset = prop.get('unset', [])
-      i = -1
+    if slugs and step.primary_key:
+      alias_ = alias + '_'
+      value_ = fnslugify(str(value), lowercase=False, regex_pattern=slugify_regex)
+      args[alias_] = value_
+      top.pop(alias_, None)
 
-      for item in unset:
-        i += 1
+  if isinstance(value, Mapping) and step.unset:
+    value = {**value}
+    i = -1
 
-        if isinstance(item, str):
-          pop(value, item)
-          continue
+    for item, condition in step.unset:
+      i += 1
 
-        condition = item.get('when')
+      try:
+        _ = (not condition or condition(args_))
+      except Exception as e:
+        raise Error(key + '/unset/' + str(i) + '/when', *e.args)
 
-        try:
-          _ = (not condition or jinja.compile_expression(condition)(**args_))
-        except Exception as e:
-          raise Error(key + '/unset/' + i + '/when', *e.args)
+      if _:
+        pop(unshare(value, item), item)
 
-        if _:
-          pop(value, item.get('key'))
+  args[alias] = value
+  top.pop(alias, None)
 
-    args[alias] = value
-    args_[alias] = value
+def init_batch(plan:tuple, rows:list, defaults:bool=True, slugs:bool=True) -> list:
+  """Same as init for each of `rows`, but one step at a time over all of them,
+  with its paths and expressions compiled once (see Step).
 
-  return args
+  Returns the rows, with the exception raised by a row in its place. Rows
+  that already are exceptions are left as they are.
+  """
+  rows = [{} if args is None else args for args in rows]
+  contexts = [None if isinstance(args, Exception) else ChainMap({'_': args}, args) for args in rows]
+
+  for step in plan:
+    for i in range(len(rows)):
+      args_ = contexts[i]
+
+      if args_ is None:
+        continue
 
-def sync(properties:Mapping, settings:Mapping, root:Mapping=None) -> dict:
+      try:
+        _init(step, rows[i], args_, defaults, slugs, rows[i])
+      except Exception as e:
+        rows[i] = e
+        contexts[i] = None
+
+  return rows
+
+def sync(plan:tuple, settings:Mapping, root:Mapping=None) -> dict:
   if settings is None:
     settings = {}
 
@@ -209,46 +370,68 @@ def sync(properties:Mapping, settings:Mapping, root:Mapping=None) -> dict:
   if root is None:
     root = this
 
-  for key, prop in properties.items():
-    sync_key = prop.get('sync', key)
+  for step in plan:
+    _sync(step, settings, this, root)
 
-    if sync_key is False:
-      continue
+  return this
 
-    condition = prop.get('when')
+def _sync(step:Step, settings:Mapping, this:dict, root:Mapping):
+  # One step of sync, see sync_batch
+  if not step.getters:
+    return
 
-    try:
-      if condition and not jinja.compile_expression(condition)(_=root, **this):
-        continue
-    except Exception as e:
-      raise Error(key + '/when', *e.args)
+  condition = step.when
 
-    if isinstance(sync_key, list):
-      for k in sync_key:
-        value = get(settings, k)
+  try:
+    if condition and not condition(this, _=root):
+      return
+  except Exception as e:
+    raise Error(step.key + '/when', *e.args)
 
-        if value is not None:
-          break
-    else:
-      value = get(settings, sync_key)
+  for get_ in step.getters:
+    value = get_(settings)
 
-    if value is None:
-      continue
+    if value is not None:
+      break
 
-    alias = prop.get('alias', key)
-    props = prop.get('properties')
+  if value is None:
+    return
 
-    if props:
-      value = sync(props, value, root)
+  if step.plan is not None:
+    value = sync(step.plan, value, root)
+
+    if not value:
+      return
+
+  this[step.alias] = value
+
+def sync_batch(plan:tuple, rows:list) -> list:
+  """Same as sync for each of `rows`, but one step at a time over all of them,
+  with its paths and expressions compiled once (see Step).
 
-      if not value:
+  Returns the synced rows, with the exception raised by a row in its place.
+  """
+  rows = [{} if settings is None else settings for settings in rows]
+  results = [{} for _ in rows]
+
+  for step in plan:
+    if not step.getters:
+      continue
+
+    for i in range(len(rows)):
+      this = results[i]
+
+      if isinstance(this, Exception):
         continue
 
-    this[alias] = value
+      try:
+        _sync(step, rows[i], this, this)
+      except Exception as e:
+        results[i] = e
 
-  return this
+  return results
 
-def tosettings(properties:Mapping, args:Mapping, defaults:bool=True, root:Mapping=None):
+def tosettings(plan:tuple, args:Mapping, defaults:bool=True, root:Mapping=None):
   if args is None:
     args = {}
 
@@ -257,28 +440,33 @@ def tosettings(properties:Mapping, args:Mapping, defaults:bool=True, root:Mappin
   if root is None:
     root = args
 
-  args_ = {'_': root, **args}
+  args_ = ChainMap({'_': root}, args)
+  top = args_.maps[0]
 
-  for key, prop in properties.items():
-    if prop.get('ignore', False):
+  for step in plan:
+    if step.ignore:
       continue
 
-    condition = prop.get('when')
+    key = step.key
+    condition = step.when
 
     try:
-      if condition and not jinja.compile_expression(condition)(**args_):
+      if condition and not condition(args_):
         continue
     except Exception as e:
       raise Error(key + '/when', *e.args)
 
-    alias = prop.get('alias', key)
+    alias = step.alias
     value = args.get(alias)
-    props = prop.get('properties')
 
     try:
-      if props:
+      if step.plan is not None:
+        if isinstance(value, Mapping):
+          # Copy on write, the value may be shared with the caller's arguments
+          value = {**value}
+
         try:
-          value = tosettings(props, value, defaults, root)
+          value = tosettings(step.plan, value, defaults, root)
         except Error as e:
           raise Error(key + '/properties/' + e.args[0], *e.args[1:])
 
@@ -289,15 +477,13 @@ def tosettings(properties:Mapping, args:Mapping, defaults:bool=True, root:Mappin
       else:
         if value is None and defaults:
           try:
-            value = getformat(prop, 'default', args_)
+            value = format_map(step.default, args_)
           except Exception as e:
             pass
 
-          value = compute(prop, value, args_)
-
-        type_ = prop.get('type', 'string')
+          value = compute(step, value, args_)
 
-        if type_ == 'list' or type_.startswith('list('):
+        if step.islist:
           if value is not None:
             if isinstance(value, str):
               try:
@@ -313,28 +499,27 @@ def tosettings(properties:Mapping, args:Mapping, defaults:bool=True, root:Mappin
 
           settings = value
         else:
-          computed = prop.get('computed')
+          computed = step.computed
 
           if computed:
             try:
-              settings = '${' + computed.format(value, **args_) + '}'
+              settings = '${' + vformat(computed, args_, value) + '}'
             except KeyError as e:
               raise KeyError('computed', *e.args)
           else:
             settings = value
 
         if settings is None:
-          if defaults and prop.get('required', False):
+          if defaults and step.required:
             raise ValueError(alias)
 
           continue
 
       if value is not None:
         args[alias] = value
-        args_[alias] = value
+        top.pop(alias, None)
 
-      key = prop.get('use', key)
-      merge(this, update({}, {key: settings}), clone=False)
+      merge(this, update({}, {step.use: settings}), clone=False)
     except KeyError as e:
       raise KeyError(key, *e.args)
 
@@ -358,6 +543,8 @@ class Properties(UserDict):
     self.owner = owner
     self.key = key
     self.context = PurePosixPath(owner.name, self.key)
+    self._plan = None
+    self._leaves = None
 
     def inherit(alias, prop):
       if alias in owner.path:
@@ -366,15 +553,22 @@ class Properties(UserDict):
     self.walk(inherit)
 
   def __call__(self, args:Mapping, defaults:bool=True, slugs:bool=True) -> dict:
-    args = merge({}, args)
+    args = merge({}, args, cow=True)
 
     try:
-      return init(self, args, defaults=defaults, slugs=slugs)
+      return init(self.plan, args, defaults=defaults, slugs=slugs)
     except KeyError as e:
       raise PatternError(self.owner.name, self.key, *e.args)
     except Error as e:
       raise Error(str(self.context / e.args[0]), *e.args[1:])
 
+  def __getstate__(self):
+    # The plan is compiled again, when needed
+    state = self.__dict__.copy()
+    state['_plan'] = None
+    state['_leaves'] = None
+    return state
+
   def _inherit(self):
     resource = self.owner
     parent = resource.parent
@@ -415,74 +609,161 @@ class Properties(UserDict):
 
     self.walk(setdefault)
     self.parent = parent
+    self._plan = None
+    self._leaves = None
 
   def heritage(self, args:Mapping) -> dict:
     this = {}
 
-    def callback(alias, prop):
-      if prop.get('inherit', prop.get('primary_key', False)):
-        value = get(args, alias)
+    for leaf in self.leaves[1]:
+      value = leaf.get(args)
 
-        if value is not None:
-          update(this, {alias: value})
-
-    self.walk(callback)
+      if value is not None:
+        leaf.set(this, value)
 
     return this
 
+  @property
+  def leaves(self) -> tuple:
+    """The primary key, inherited and synced leaves, once inherited."""
+    if self._leaves is None:
+      self._leaves = compile_leaves(self.data)
+
+    return self._leaves
+
+  @property
+  def plan(self) -> tuple:
+    """The properties compiled into steps, once inherited."""
+    if self._plan is None:
+      self._plan = compile_plan(self.data)
+
+    return self._plan
+
   def primarykey(self, args:Mapping, slugs:Mapping=None, required:set=None) -> dict:
     this = {}
 
-    def callback(alias, prop):
-      if prop.get('primary_key', False):
-        condition = prop.get('when')
+    for leaf in self.leaves[0]:
+      if leaf.when:
+        args_ = args if leaf.base is None else leaf.base(args)
+
+        if not leaf.when(args_, _=args):
+          continue
 
-        if condition:
-          _ = dirname(alias)
-          args_ = args if _ == '' else get(args, _)
+      value = leaf.get(args)
 
-          if not jinja.compile_expression(condition)(_=args, **args_):
-            return
+      if value is None:
+        if required is not None and leaf.required:
+          required.add(leaf.alias)
+      else:
+        leaf.set(this, value)
 
-        value = get(args, alias)
+        if slugs is not None:
+          value = leaf.slug[0](args)
 
-        if value is None:
-          if required is not None and prop.get('required', True):
-            required.add(alias)
-        else:
-          update(this, {alias: value})
+          if value is not None:
+            leaf.slug[1](slugs, value)
 
-          if slugs is not None:
-            alias += '_'
-            value = get(args, alias)
+    return this
 
-            if value is not None:
-              update(slugs, {alias: value})
+  def project(self, objects:list, heritage:Mapping=None, where=None) -> list:
+    """Syncs a batch of remote objects and initializes them.
 
-    self.walk(callback)
+    Same as `self(merge(heritage, self.sync(_), cow=True), defaults=False,
+    slugs=False)` for each object, but running each property over the whole
+    batch at a time. Returns [synced, initialized] pairs, with the exception
+    raised by an object in its place.
 
-    return this
+    Objects for which `where` returns false once synced are not initialized,
+    and are None instead (see pushdown).
+
+    Synced values are copies, as objects may be the cached output of a command
+    shared with other resources, while rows end up changed in place.
+    """
+    plan = self.plan
+    synced = [_ if isinstance(_, Exception) else merge(heritage, _, cow=True) for _ in sync_batch(plan, objects)]
+
+    if where:
+      synced = [_ if isinstance(_, Exception) or where(_) else None for _ in synced]
+
+    synced = [_ if _ is None or isinstance(_, Exception) else clone(_) for _ in synced]
+
+    selected = [i for i in range(len(synced)) if synced[i] is not None]
+    rows = [None] * len(synced)
+    args = [_ if isinstance(_, Exception) else merge({}, _, cow=True) for _ in (synced[i] for i in selected)]
+
+    for i, _ in zip(selected, init_batch(plan, args, defaults=False, slugs=False)):
+      rows[i] = _
+
+    for i in selected:
+      args = rows[i]
+
+      if isinstance(synced[i], Exception):
+        # Raised by sync, as is
+        continue
+
+      # Same as __call__
+      if isinstance(args, KeyError):
+        rows[i] = PatternError(self.owner.name, self.key, *args.args)
+      elif isinstance(args, Error):
+        rows[i] = Error(str(self.context / args.args[0]), *args.args[1:])
+      elif not isinstance(args, Exception):
+        rows[i] = [synced[i], args]
+
+    return rows
+
+  def pushdown(self, filters:Mapping) -> list:
+    """Splits remote filters into those matching the same before and after init.
+
+    Those are on properties that init leaves as they are, and that no pattern
+    fills with a named group, so they can be matched against synced objects,
+    before initializing them (see project). Returns both parts of `filters`.
+    """
+    steps = {}
+    groups = set()
+
+    def collect(plan):
+      for step in plan:
+        for pattern in step.patterns:
+          groups.update(pattern.groupindex)
+
+        if step.plan:
+          collect(step.plan)
+
+    for step in self.plan:
+      steps.setdefault(step.alias, []).append(step)
+
+    collect(self.plan)
+    before = {}
+    after = {}
+
+    for key, value in filters.items():
+      _ = steps.get(key, [])
+
+      # Paths may resolve differently once nested properties are initialized
+      if len(_) == 1 and _[0].passthrough and key not in groups and '/' not in key:
+        before[key] = value
+      else:
+        after[key] = value
+
+    return [before, after]
 
   def remote(self, args:Mapping) -> dict:
     this = {}
 
-    def callback(alias, prop):
-      if prop.get('sync', True) != False:
-        value = get(args, alias)
+    for leaf in self.leaves[2]:
+      value = leaf.get(args)
 
-        if value is not None:
-          update(this, {alias: value})        
-
-    self.walk(callback)
+      if value is not None:
+        leaf.set(this, value)
 
     return this
 
   def sync(self, settings:Mapping) -> dict:
-    return sync(self, settings)
+    return sync(self.plan, settings)
 
   def tosettings(self, args:Mapping, defaults:bool=True) -> dict:
     try:
-      settings = tosettings(self, args, defaults=defaults)
+      settings = tosettings(self.plan, args, defaults=defaults)
     except KeyError as e:
       raise PatternError(self.owner.name, self.key, *e.args)
 
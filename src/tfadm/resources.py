@@ -1,14 +1,17 @@
+from .cache import signature, ResourceCache
+from .dag import execute, toposort, CycleError
 from .exceptions import Error, PatternError
 from .methods import Method, Methods
 from .module import Module
 from .path import VirtualPath
 from .properties import Properties
 from .settings import merge, pop, Descriptor, Settings
-from .template import jinja, Template
+from .template import compile_expression, Template
 from collections.abc import Mapping
 from os import chdir
 from os.path import dirname, join as joinpath
 from pathlib import Path
+from threading import RLock
 import errno
 
 class Resource(Settings):
@@ -69,6 +72,10 @@ class Resource(Settings):
       self.source = joinpath(dirname(parent.source), self.source)
 
     self.root = dirname(self.module.file if self.module.file and self.module.file.endswith('.tf.json') else self.source)
+    self._state()
+
+  def _state(self):
+    parent = self.parent
     state = None
 
     while parent and parent.root == self.root:
@@ -80,6 +87,13 @@ class Resource(Settings):
 
     self.state = state
 
+  def __getstate__(self):
+    # The owner and the Terraform state are bound to the running process
+    state = self.__dict__.copy()
+    state.pop('owner', None)
+    state.pop('state', None)
+    return state
+
   def format(self, key, args, default=None):
     try:
       return super().format(key, args, default)
@@ -106,7 +120,7 @@ class Resource(Settings):
       condition = action.get('when')
 
       try:
-        if condition and not jinja.compile_expression(condition)(**settings):
+        if condition and not compile_expression(condition)(settings):
           continue
       except Exception as e:
         raise Error(self.name + '/events/onbeforesave' + i_.format(i) + 'when', *e.args)
@@ -138,7 +152,7 @@ class Resource(Settings):
           condition = item.get('when')
 
           try:
-            if condition and not jinja.compile_expression(condition)(**args):
+            if condition and not compile_expression(condition)(args):
               continue
           except Exception as e:
             raise Error(self.name + '/events/' + event + '/' + cmd_name + '/' + i + '/when', *e.args)
@@ -166,7 +180,7 @@ class Resource(Settings):
 
             condition = key.get('when')
 
-            if not condition or jinja.compile_expression(condition)(**args):
+            if not condition or compile_expression(condition)(args):
               _.pop(key.get('key'))
 
           method(_.merge(item.get('args')), **merge({}, options, item.get('options', {})))
@@ -199,62 +213,101 @@ class Resources(dict):
 
     chdir(root_dir)
     self.root_dir = root_dir
+    self.config_dir = config_dir
+    self.cache = ResourceCache(root_dir, self.paths)
+    self.cached = None
+    self.files = {}
+    self.levels = {}
+    self.lock = RLock()
+    self.loading = 0
+    self.dirty = False
+
+  def each(self, callback, parent=None, *args, jobs:int=1, **kwds):
+    if jobs > 1:
+      nodes, depends_on = self.graph(parent)
+      return execute(nodes, depends_on, lambda name: callback(self[name], *args, **kwds), jobs)
+
+    count = 0
+
+    for resource in self.level(parent):
+      if resource.name.startswith('.'):
+        count += self.each(lambda r: callback(r, *args, **kwds), resource)
+      else:
+        callback(resource, *args, **kwds)
+        count += 1
+
+    return count
+
+  def graph(self, parent=None) -> list:
+    """Returns the names of the resources synced under `parent`, with hidden
+    group resources expanded, and the names each one has to wait for."""
+    nodes = []
+    depends_on = {}
+
+    def expand(parent, inherited:set) -> list:
+      leaves = {}
+
+      for resource in self.level(parent):
+        name = resource.name
+        deps = set(inherited)
 
-  def each(self, callback, parent=None, *args, **kwds):
-    resources = []
+        # Dependencies come first within a level
+        for dependency in resource.depends_on:
+          deps.update(leaves.get(self.load(dependency).name, ()))
+
+        if name.startswith('.'):
+          leaves[name] = expand(resource, deps)
+        else:
+          nodes.append(name)
+          depends_on[name] = deps
+          leaves[name] = [name]
+
+      return [_ for names in leaves.values() for _ in names]
+
+    expand(parent, set())
+
+    return [nodes, depends_on]
+
+  def level(self, parent=None) -> list:
+    """Returns the resources synced right under `parent`, dependencies first."""
+    key = None if parent is None else parent.name
+    levels = self.levels
+
+    if key in levels:
+      return levels[key]
+
+    resources = {}
 
     # Get all the the resources at the same level
-    for resource in self.values():
+    for resource in [*self.values()]:
       _ = resource.methods['sync'].parent
       _ = resource.parent if _ is None else _.owner
 
       if _ is parent:
-        resources.append(resource)
+        resources[resource.name] = resource
 
-    # Auxiliar variable to detect if it enters an infinite loop due to bad
-    # `depends_on` configuration
-    done = []
-    count = 0
-    skipped = 0
+    depends_on = {}
 
-    while resources:
-      execute = True
-      resource = resources.pop(0)
-      depends_on = resource.depends_on
+    for name, resource in resources.items():
+      depends_on[name] = []
 
-      if depends_on:
-        for dependency in depends_on:
-          dependency = self.load(dependency)
+      for dependency in resource.depends_on:
+        dependency = self.load(dependency).name
 
-          if dependency.name == resource.name:
-            # Ignore if it depends on it self
-            continue
+        if dependency not in resources:
+          raise Error(name + '/depends_on', 'No sibling resource named', dependency)
 
-          if dependency.name not in done:
-            execute = False
-            break
+        depends_on[name].append(dependency)
 
-      if execute:
-        done.append(resource.name)
+    try:
+      order = toposort([*resources], depends_on)
+    except CycleError as e:
+      raise CycleError(e.cycle[0] + '/depends_on', e.cycle)
 
-        if resource.name.startswith('.'):
-          count += self.each(lambda r: callback(r, *args, **kwds), resource)
-        else:
-          callback(resource, *args, **kwds)
-          count += 1
-
-        skipped = 0
-      elif skipped < len(resources):
-        # Puts the resource back on queue
-        resources.append(resource)
-        # Increases skipped by one in order to stop the cycle if unable to
-        # resolve all dependencies
-        skipped += 1
-      else:
-        # Raise error in case of bad configuration
-        raise Error(resource.name + '/depends_on', str(depends_on))
+    # Loading dependencies may have reset the levels
+    self.levels[key] = levels = [resources[name] for name in order]
 
-    return count
+    return levels
 
   def extendConfig(self, cfg:Mapping, current=None):
     extends = cfg.pop('extends', None)
@@ -283,20 +336,77 @@ class Resources(dict):
     if resource is not None:
       return resource
 
-    file, cfg = self.loadConfig(name)
-    cfg = self.extendConfig(cfg, file)
+    with self.lock:
+      return self._load(name)
+
+  def _load(self, name:str):
+    resource = self.get(name)
+
+    if resource is not None:
+      return resource
+
+    self.loading += 1
+
+    try:
+      resource = self.restore(name)
+
+      if resource is None:
+        file, cfg = self.loadConfig(name)
+        cfg = self.extendConfig(cfg, file)
+
+        self[name] = resource = Resource(self, name, cfg, self.load(cfg.pop('parent', None)))
+        self.levels = {}
+        self.dirty = True
+    finally:
+      self.loading -= 1
 
-    self[name] = resource = Resource(self, name, cfg, self.load(cfg.pop('parent', None)))
+    self.save()
 
     return resource
 
   def loadAll(self):
-    for file in self.paths[0].iterdir():
-      if file.suffix in ['.yml', '.yaml'] and not file.name.startswith('.'):
-        self.load(file.name)
+    with self.lock:
+      self.loading += 1
+
+      try:
+        for file in self.paths[0].iterdir():
+          if file.suffix in ['.yml', '.yaml'] and not file.name.startswith('.'):
+            self.load(file.name)
+      finally:
+        self.loading -= 1
+
+      self.save()
 
     return self
 
+  def restore(self, name:str):
+    """Takes a resource from the on-disk cache, along with its parents."""
+    if self.cached is None:
+      self.files, self.cached = self.cache.load()
+
+      for path in self.paths:
+        self.files.setdefault(str(path), signature(path))
+
+    resource = self.cached.pop(name, None)
+
+    if resource is not None:
+      if resource.parent:
+        self.load(resource.parent.name)
+
+      resource.owner = self
+      resource._state()
+      self[name] = resource
+      self.levels = {}
+
+    return resource
+
+  def save(self):
+    # Only save once the outermost load is done, so the whole parent chain
+    # gets resolved
+    if self.dirty and not self.loading:
+      self.cache.save(self.files, {**self.cached, **self})
+      self.dirty = False
+
   def loadConfig(self, name:str, current=None) -> list:
     for path in self.paths:
       file = path / name
@@ -308,6 +418,7 @@ class Resources(dict):
           file = file.with_suffix('.yaml')
 
       if file.is_file() and file != current:
+        self.files[str(file)] = signature(file)
         return [file, Resource.load(file)]
 
     raise FileNotFoundError(errno.ENOENT, 'No such file', (self.paths[0] / file.with_suffix('.yml').stem).relative_to(self.root_dir).__str__())
@@ -0,0 +1,139 @@
+from asyncio import create_subprocess_exec, new_event_loop, run_coroutine_threadsafe, sleep, Condition
+from asyncio.subprocess import PIPE
+from click import secho
+from concurrent.futures import Future
+from random import uniform
+from shlex import join as joincmd
+from subprocess import CalledProcessError
+from threading import Lock, Thread
+import re
+import sys
+
+class Limiter:
+  """Adaptive limit of concurrent commands, up to `maximum`.
+
+  Additive increase, multiplicative decrease: the limit grows by one for
+  every limit's worth of successful commands, and halves whenever a command
+  is throttled. Created within the event loop.
+  """
+  def __init__(self, maximum:int):
+    self.maximum = maximum
+    self.limit = float(maximum)
+    self.active = 0
+    self.condition = Condition()
+
+  async def acquire(self):
+    async with self.condition:
+      await self.condition.wait_for(lambda: self.active < int(self.limit))
+      self.active += 1
+
+  async def release(self, ok:bool, throttled:bool=False):
+    async with self.condition:
+      self.active -= 1
+
+      if throttled:
+        self.limit = max(1.0, self.limit / 2)
+      elif ok:
+        self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+
+      self.condition.notify_all()
+
+class Retry:
+  """Retry policy of a command, run up to `attempts` times.
+
+  Failures are retried when the exit code is one of `codes`, or stderr
+  matches one of the `patterns`, or always if neither is given, waiting a
+  random delay of up to `delay` seconds, doubled on each attempt, up to
+  `max_delay`.
+  """
+  def __init__(self, attempts:int=3, codes:list=None, patterns:list=None, delay:float=1, max_delay:float=30):
+    self.attempts = attempts
+    self.codes = set(codes or [])
+    self.patterns = [re.compile(_.encode()) for _ in patterns or []]
+    self.delay = delay
+    self.max_delay = max_delay
+
+  def backoff(self, attempt:int) -> float:
+    """Returns the delay before another `attempt`, with full jitter."""
+    return uniform(0, min(self.max_delay, self.delay * 2 ** (attempt - 1)))
+
+  def match(self, returncode:int, stderr:bytes) -> bool:
+    if not self.codes and not self.patterns:
+      return True
+
+    return returncode in self.codes or any(_.search(stderr or b'') for _ in self.patterns)
+
+  def report(self, argv:list, returncode:int, attempt:int) -> float:
+    """Prints that `argv` is retried, returning the delay before it is."""
+    delay = self.backoff(attempt)
+    secho('$ {}: Exit code {}, retrying in {:.1f}s ({}/{})'.format(joincmd(argv), returncode, delay, attempt, self.attempts - 1), err=True, fg='yellow')
+    return delay
+
+class Runner:
+  """Runs commands on an asyncio event loop, at most `limit` at a time.
+
+  The loop runs in a background thread, started when first needed, so commands
+  are submitted from any thread, and either waited for right away (see run) or
+  later, while others run. The limit adapts to throttling (see Limiter).
+  """
+  def __init__(self, limit:int=8):
+    self.limit = limit
+    self.loop = None
+    self.limiter = None
+    self.mutex = Lock()
+
+  async def execute(self, argv:list, retry:Retry=None) -> bytes:
+    """Same as `check_output(argv)`, retrying failures as `retry` says."""
+    attempt = 0
+
+    while True:
+      attempt += 1
+      await self.limiter.acquire()
+
+      try:
+        # Captured to be matched, when retrying
+        proc = await create_subprocess_exec(*argv, stdout=PIPE, stderr=PIPE if retry else None)
+        output, errors = await proc.communicate()
+      except BaseException:
+        await self.limiter.release(False)
+        raise
+
+      throttled = bool(proc.returncode) and retry is not None and retry.match(proc.returncode, errors)
+      await self.limiter.release(not proc.returncode, throttled)
+
+      if errors:
+        sys.stderr.buffer.write(errors)
+        sys.stderr.flush()
+
+      if not proc.returncode:
+        return output
+
+      if not throttled or attempt >= retry.attempts:
+        raise CalledProcessError(proc.returncode, argv, output, errors)
+
+      await sleep(retry.report(argv, proc.returncode, attempt))
+
+  def run(self, argv:list, retry:Retry=None) -> bytes:
+    return self.submit(argv, retry).result()
+
+  def start(self):
+    with self.mutex:
+      if self.loop is not None:
+        return
+
+      loop = new_event_loop()
+      Thread(target=loop.run_forever, name='runner', daemon=True).start()
+
+      async def init():
+        # Bound to the running loop
+        self.limiter = Limiter(self.limit)
+
+      run_coroutine_threadsafe(init(), loop).result()
+      self.loop = loop
+
+  def submit(self, argv:list, retry:Retry=None) -> Future:
+    """Starts running a command, returning the future of its output."""
+    self.start()
+    return run_coroutine_threadsafe(self.execute(list(argv), retry), self.loop)
+
+runner = Runner()
@@ -1,10 +1,13 @@
-from collections import UserDict
-from fnmatch import fnmatchcase
+from .files import atomic_write
+from .parsers import dump, dump_yaml, load
+from collections import ChainMap, UserDict
+from collections.abc import Iterator, Mapping, Sequence
+from fnmatch import fnmatchcase, translate
+from functools import lru_cache
 from io import StringIO
-from json import dump as dump_json
+from string import Formatter
 from sys import stdout
-from typing import Any, Sequence, Mapping
-from yaml import dump as dump_yaml, load as load_yaml, FullLoader
+from typing import Any
 import re
 
 def format_map(format_spec:Any, args:Mapping) -> Any:
@@ -35,36 +38,116 @@ def format_map(format_spec:Any, args:Mapping) -> Any:
 
   return format_spec
 
+@lru_cache(maxsize=1024)
+def compile_format(format_spec:str) -> str:
+  """Rewrites the positional fields of `format_spec` as named fields, see vformat."""
+  return _compile_format(format_spec, [0])
+
+def _compile_format(format_spec:str, index:list) -> str:
+  # Auto-numbered fields count on within nested format specs, like str.format
+  result = []
+
+  for literal, field, spec, conversion in Formatter().parse(format_spec):
+    result.append(literal.replace('{', '{{').replace('}', '}}'))
+
+    if field is None:
+      continue
+
+    name = re.match(r'[^.[]*', field).group()
+
+    if name == '':
+      field = '#' + str(index[0]) + field
+      index[0] += 1
+    elif name.isdigit():
+      field = '#' + field
+
+    if conversion:
+      field += '!' + conversion
+
+    if spec:
+      field += ':' + _compile_format(spec, index)
+
+    result.append('{' + field + '}')
+
+  return ''.join(result)
+
+def vformat(format_spec:str, args:Mapping, *values) -> str:
+  """Same as `format_spec.format(*values, **args)`, without copying `args`."""
+  return compile_format(format_spec).format_map(ChainMap({'#' + str(i): v for i, v in enumerate(values)}, args))
+
+@lru_cache(maxsize=4096)
+def compile_path(path:str) -> tuple:
+  """Parses a slash separated path into (key, index) segments.
+
+  `index` is the key as an integer, or None if it isn't one. Paths are
+  parsed once and cached.
+  """
+  parts = []
+
+  for key in path.split('/'):
+    try:
+      index = int(key)
+    except ValueError:
+      index = None
+
+    parts.append((key, index))
+
+  return tuple(parts)
+
 def get(settings:Any, path:str, default:Any = None, flatten:bool = True) -> Any:
-  if isinstance(settings, Mapping):
-    for key, value in settings.items():
-      if key == path:
-        return value
+  return _get(settings, compile_path(path), 0, default, flatten)
 
-      if path.startswith(key + '/'):
-        return get(value, path[len(key) + 1:], default, flatten)
+def getter(path:str):
+  """Returns a function doing `get(settings, path)`, with `path` parsed once."""
+  parts = compile_path(path)
 
-    return default
+  if len(parts) > 1:
+    return lambda settings: _get(settings, parts, 0, None, True)
 
-  if isinstance(settings, Sequence) and not isinstance(settings, str):
+  key = parts[0][0]
+
+  def get(settings):
+    if type(settings) is dict:
+      return settings.get(key)
+
+    return _get(settings, parts, 0, None, True)
+
+  return get
+
+def _get(settings:Any, parts:tuple, i:int, default:Any, flatten:bool) -> Any:
+  cls = type(settings)
+
+  if cls is dict or (cls is not list and isinstance(settings, Mapping)):
     try:
-      try:
-        return settings[int(path)]
-      except ValueError:
-        pass
+      value = settings[parts[i][0]]
+    except KeyError:
+      return _getkeys(settings, parts, i, default, flatten)
+    except TypeError:
+      return default
+
+    if i + 1 == len(parts):
+      return value
+
+    return _get(value, parts, i + 1, default, flatten)
 
+  if cls is list or (isinstance(settings, Sequence) and not isinstance(settings, str)):
+    index = parts[i][1]
+
+    if index is not None:
       try:
-        i = path.index('/')
-        return get(settings[int(path[0:i])], path[i + 1:], default, flatten)
-      except ValueError:
-        pass
-    except IndexError:
-      return default
+        value = settings[index]
+      except IndexError:
+        return default
+
+      if i + 1 == len(parts):
+        return value
+
+      return _get(value, parts, i + 1, default, flatten)
 
     values = []
 
     for value in settings:
-      value = get(value, path, default, flatten)
+      value = _get(value, parts, i, default, flatten)
 
       if value is not None:
         if flatten and isinstance(value, Sequence) and not isinstance(value, str):
@@ -76,6 +159,69 @@ def get(settings:Any, path:str, default:Any = None, flatten:bool = True) -> Any:
 
   return default
 
+def _getkeys(settings:Mapping, parts:tuple, i:int, default:Any, flatten:bool) -> Any:
+  # Slow path, for keys that contain slashes themselves
+  path = '/'.join(_[0] for _ in parts[i:])
+
+  for key, value in settings.items():
+    if not isinstance(key, str) or '/' not in key:
+      continue
+
+    if key == path:
+      return value
+
+    if path.startswith(key + '/'):
+      return _get(value, parts, i + key.count('/') + 1, default, flatten)
+
+  return default
+
+def iterget(settings:Any, path:str) -> Iterator:
+  """Lazily yields the values of `get(settings, path)`, if it is a list.
+
+  Traverses lists the same way `get` does, flattening the values found, but
+  without building the resulting list.
+  """
+  return _iterget(settings, compile_path(path), 0)
+
+def _iterget(settings:Any, parts:tuple, i:int) -> Iterator:
+  cls = type(settings)
+
+  if cls is dict or (cls is not list and isinstance(settings, Mapping)):
+    try:
+      value = settings[parts[i][0]]
+    except KeyError:
+      value = _getkeys(settings, parts, i, None, True)
+      i = len(parts) - 1
+    except TypeError:
+      return
+
+    if i + 1 < len(parts):
+      yield from _iterget(value, parts, i + 1)
+    elif isinstance(value, Sequence) and not isinstance(value, str):
+      yield from value
+    elif value is not None:
+      yield value
+  elif cls is list or (isinstance(settings, Sequence) and not isinstance(settings, str)):
+    index = parts[i][1]
+
+    if index is None:
+      for value in settings:
+        yield from _iterget(value, parts, i)
+
+      return
+
+    try:
+      value = settings[index]
+    except IndexError:
+      return
+
+    if i + 1 < len(parts):
+      yield from _iterget(value, parts, i + 1)
+    elif isinstance(value, Sequence) and not isinstance(value, str):
+      yield from value
+    elif value is not None:
+      yield value
+
 def getformat(settings:Any, path:str, args:Mapping, default:Any = None) -> Any:
   try:
     value = format_map(get(settings, path), args)
@@ -121,41 +267,211 @@ def match(settings:Any, patterns:Any, literally:bool = False, default:bool = Fal
 
   return False
 
-def merge(result:Any, *others, extend:bool = False, clone:bool = True) -> Any:
+def clone(value:Any) -> Any:
+  """Deep copies mappings and sequences into plain dicts and lists."""
+  cls = type(value)
+
+  if cls is str or value is None:
+    return value
+
+  if cls is dict:
+    return {k: clone(v) for k, v in value.items()}
+
+  if cls is list:
+    return [clone(_) for _ in value]
+
+  if cls is int or cls is float or cls is bool:
+    return value
+
+  if isinstance(value, Mapping):
+    return {k: clone(v) for k, v in value.items()}
+
+  if isinstance(value, Sequence) and not isinstance(value, str):
+    return [clone(_) for _ in value]
+
+  return value
+
+_clone = clone
+
+def compile_match(patterns:Any, literally:bool = False, default:bool = False):
+  """Compiles `patterns` into a matcher.
+
+  The matcher is a function of the settings to match, equivalent to
+  `match(settings, patterns, literally, default)`, but with paths parsed and
+  glob patterns translated to regular expressions only once.
+  """
+  if isinstance(patterns, Mapping):
+    items = []
+
+    for key, pattern in patterns.items():
+      items.append((None if key == '$not' else compile_path(key), compile_match(pattern, literally, default)))
+
+    def matcher(settings):
+      if settings == patterns:
+        return True
+
+      if settings is None:
+        return default
+
+      for parts, match_ in items:
+        if parts is None:
+          if match_(settings):
+            return False
+        elif not isinstance(settings, Mapping) or not match_(_get(settings, parts, 0, None, True)):
+          return False
+
+      return True
+
+    return matcher
+
+  if isinstance(patterns, Sequence) and not isinstance(patterns, str):
+    matchers = [compile_match(_, literally, default) for _ in patterns]
+
+    def matcher(settings):
+      if settings == patterns:
+        return True
+
+      if settings is None:
+        return default
+
+      for match_ in matchers:
+        if match_(settings):
+          return True
+
+      return False
+
+    return matcher
+
+  if literally or not isinstance(patterns, str):
+    def matcher(settings):
+      if settings == patterns:
+        return True
+
+      return default if settings is None else False
+
+    return matcher
+
+  if not glob_chars.search(patterns):
+    # Without wildcards, it's a string comparison
+    def matcher(settings):
+      if settings == patterns:
+        return True
+
+      if settings is None:
+        return default
+
+      return str(settings) == patterns
+
+    return matcher
+
+  regex = re.compile(translate(patterns)).match
+
+  def matcher(settings):
+    if settings == patterns:
+      return True
+
+    if settings is None:
+      return default
+
+    return regex(str(settings)) is not None
+
+  return matcher
+
+glob_chars = re.compile(r'[*?[]')
+
+def compile_index(patterns:list):
+  """Compiles literal patterns into a function listing those matching settings.
+
+  The function returns the indexes of the patterns that `match(settings,
+  pattern, literally=True)`, settings being a mapping. Mappings of scalar
+  values are grouped by their keys and looked up by hash, all at once.
+  """
+  groups = {}
+  others = []
+
+  for i, pattern in enumerate(patterns):
+    if isinstance(pattern, Mapping) and '$not' not in pattern and all(type(_) in scalar_types for _ in pattern.values()):
+      keys = tuple(sorted(pattern))
+      group = groups.get(keys)
+
+      if group is None:
+        groups[keys] = group = (tuple(compile_path(_) for _ in keys), {})
+
+      group[1].setdefault(tuple(pattern[_] for _ in keys), []).append(i)
+    else:
+      others.append((i, compile_match(pattern, literally=True)))
+
+  groups = list(groups.values())
+
+  def matcher(settings):
+    found = []
+
+    for paths, table in groups:
+      try:
+        found.extend(table.get(tuple(_get(settings, _, 0, None, True) for _ in paths), ()))
+      except TypeError:
+        # Unhashable values never equal scalars
+        pass
+
+    for i, match_ in others:
+      if match_(settings):
+        found.append(i)
+
+    return found
+
+  return matcher
+
+scalar_types = (str, int, float, bool)
+
+def merge(result:Any, *others, extend:bool = False, clone:bool = True, cow:bool = False) -> Any:
+  """Merges `others` into `result`, returning the result.
+
+  By default, `result` is changed in place and `others` are deep copied into
+  it. With `cow` (copy-on-write), `result` is left untouched instead: only the
+  containers that change are copied, and everything else is shared with
+  `result` and `others`, so the returned value must not be changed in place.
+  """
+  if cow:
+    clone = False
+
   for other in others:
     if other is None:
       continue
 
     if isinstance(other, Mapping):
       if isinstance(result, Mapping):
+        if cow:
+          result = {**result}
+
         for key, value in other.items():
           if value is None:
             result[key] = value
           else:
-            result[key] = merge(result.get(key), value, extend=extend, clone=clone)
+            result[key] = merge(result.get(key), value, extend=extend, clone=clone, cow=cow)
       elif isinstance(result, Sequence) and not isinstance(result, str):
+        if cow:
+          result = [*result]
+
         try:
           for key, value in other.items():
             i = int(key)
-            result[i] = merge(result[i], value, extend=extend, clone=clone)
+            result[i] = merge(result[i], value, extend=extend, clone=clone, cow=cow)
         except:
           if clone:
-            other = merge({}, other)
+            other = _clone(other)
 
           if extend:
             result.append(other)
           else:
             result = other
       else:
-        result = merge({}, other) if clone else other
+        result = _clone(other) if clone else other
     elif isinstance(other, Sequence) and not isinstance(other, str):
       if clone:
-        other = [merge(None, _) for _ in other]
+        other = [_clone(_) for _ in other]
 
       if extend and isinstance(result, Sequence) and not isinstance(result, str):
-        for value in other:
-          if value not in result:
-            result.append(value)
+        result = union([*result] if cow else result, other)
       else:
         result = other
     else:
@@ -163,7 +479,93 @@ def merge(result:Any, *others, extend:bool = False, clone:bool = True) -> Any:
 
   return result
 
+def union(result:list, values) -> list:
+  """Appends to `result` the `values` it doesn't have yet."""
+  seen = set()
+  unhashable = []
+
+  for value in result:
+    try:
+      seen.add(value)
+    except TypeError:
+      unhashable.append(value)
+
+  for value in values:
+    try:
+      if value in seen:
+        continue
+
+      seen.add(value)
+    except TypeError:
+      if value in unhashable:
+        continue
+
+      unhashable.append(value)
+
+    result.append(value)
+
+  return result
+
+def unshare(settings:Any, path:str) -> Any:
+  """Copies the containers along `path` that are shared with other settings.
+
+  Call it before changing anything under `path` in place (e.g. with `pop`),
+  on settings created with copy-on-write (see `merge`). `settings` itself must
+  already be a copy.
+  """
+  _unshare(settings, compile_path(path), 0)
+  return settings
+
+def _unshare(settings:Any, parts:tuple, i:int):
+  if i + 1 >= len(parts):
+    return
+
+  if isinstance(settings, list):
+    for j in range(len(settings)):
+      settings[j] = _copy(settings[j])
+      _unshare(settings[j], parts, i)
+  elif isinstance(settings, Mapping):
+    key = parts[i][0]
+    value = settings.get(key)
+
+    if value is not None:
+      settings[key] = value = _copy(value)
+      _unshare(value, parts, i + 1)
+
+def detach(settings:Any, path:str, value:Any) -> Any:
+  """Replaces `value`, the one at `path` or one of its items, by a deep copy.
+
+  The containers along `path` are copied too (see unshare), so that nothing
+  shared with other settings changes. Returns the copy, to be changed in place.
+  """
+  unshare(settings, path)
+  parts = compile_path(path)
+  container = _get(settings, parts, 0, None, False)
+  copy = clone(value)
+
+  if container is value:
+    container = copy
+  elif isinstance(container, list):
+    container = [copy if _ is value else _ for _ in container]
+  elif isinstance(container, Mapping):
+    container = {k: copy if v is value else v for k, v in container.items()}
+
+  _set(settings, parts, 0, container)
+  return copy
+
+def _copy(value:Any) -> Any:
+  if isinstance(value, Mapping):
+    return {**value}
+
+  if isinstance(value, list):
+    return [*value]
+
+  return value
+
 def pop(settings:Any, key:str, default = None, flatten:bool = True):
+  return _pop(settings, compile_path(key), 0, default, flatten)
+
+def _pop(settings:Any, parts:tuple, i:int, default, flatten:bool):
   if settings is None:
     return default
 
@@ -172,13 +574,13 @@ def pop(settings:Any, key:str, default = None, flatten:bool = True):
       deleted = 0
       values = []
 
-      for i in range(len(settings)):
-        i -= deleted
+      for j in range(len(settings)):
+        j -= deleted
 
-        value = pop(settings[i], key, flatten=flatten)
+        value = _pop(settings[j], parts, i, None, flatten)
 
-        if not settings[i]:
-          del settings[i]
+        if not settings[j]:
+          del settings[j]
           deleted += 1
 
         if value is None:
@@ -191,14 +593,14 @@ def pop(settings:Any, key:str, default = None, flatten:bool = True):
 
       return values if values else default
 
-    try:
-      i = key.index('/')
-      k = key[0:i]
-      value = pop(settings[k], key[i + 1:], default, flatten)
-      if not settings[k]: del settings[k]
-      return value
-    except ValueError:
-      return settings.pop(key, default)
+    k = parts[i][0]
+
+    if i + 1 == len(parts):
+      return settings.pop(k, default)
+
+    value = _pop(settings[k], parts, i + 1, default, flatten)
+    if not settings[k]: del settings[k]
+    return value
   except KeyError:
     return default
 
@@ -206,29 +608,54 @@ def update(settings:Any, other:Mapping) -> Mapping:
   if isinstance(settings, Sequence) and not isinstance(settings, str):
     try:
       for key, value in other.items():
-        i = key.index('/')
-        k = int(key[0:i])
+        parts = compile_path(key)
+        index = parts[0][1]
 
-        try:
-          settings[k] = update(settings[k], {key[i + 1:]: value})
-        except:
-          settings[key] = value
+        if len(parts) == 1 or index is None:
+          raise ValueError(key)
+
+        settings[index] = _set(settings[index], parts, 1, value)
     except:
       for item in settings:
         update(item, other)
 
     return settings
 
+  for key, value in other.items():
+    settings = _set(settings, compile_path(key), 0, value)
+
+  return settings
+
+def setter(path:str):
+  """Returns a function doing `update(settings, {path: value})`, with `path` parsed once."""
+  parts = compile_path(path)
+
+  def set(settings, value):
+    if isinstance(settings, Sequence) and not isinstance(settings, str):
+      return update(settings, {path: value})
+
+    return _set(settings, parts, 0, value)
+
+  return set
+
+def _set(settings:Any, parts:tuple, i:int, value:Any) -> Any:
+  # Same as `update(settings, {path: value})`, path being parts[i:]
+  if isinstance(settings, Sequence) and not isinstance(settings, str):
+    return update(settings, {'/'.join(_[0] for _ in parts[i:]): value})
+
   if settings is None:
     settings = {}
 
-  for key, value in other.items():
-    try:
-      i = key.index('/')
-      k = key[0:i]
-      settings[k] = update(settings.get(k), {key[i + 1:]: value})
-    except:
-      settings[key] = value
+  key = parts[i][0]
+
+  if i + 1 == len(parts):
+    settings[key] = value
+    return settings
+
+  try:
+    settings[key] = _set(settings.get(key), parts, i + 1, value)
+  except:
+    settings['/'.join(_[0] for _ in parts[i:])] = value
 
   return settings
 
@@ -236,7 +663,7 @@ def pprint(data, **opts):
   opts.setdefault('explicit_start', False)
   opts.setdefault('sort_keys', False)
   opts.setdefault('stream', stdout)
-  dump_yaml(merge({}, data), **opts)
+  dump_yaml(data, **opts)
 
 class Descriptor():
   def __init__(self, key, default=None):
@@ -286,7 +713,7 @@ class Settings(UserDict):
     return match(self, patterns, true=true, literally=literally, default=default)
 
   def merge(self, *others, **opts):
-    merge(self.data, *others, **opts)
+    self.data = merge(self.data, *others, **opts)
     return self
 
   def pop(self, key, default=None, flatten=True):
@@ -315,23 +742,17 @@ class Settings(UserDict):
     pprint(self, **opts)
 
   @classmethod
-  def dump(self, filename:str, data, **opts):
-    data = merge({}, data)
-
-    with open(filename, 'w') as fp:
-      if filename.endswith('.json'):
-        opts.setdefault('indent', 2)
-        dump_json(data, fp, **opts)
-        print(file=fp)
-      else:
-        dump_yaml(data, stream=fp, **opts)
+  def dump(self, filename:str, data, **opts) -> bool:
+    """Atomically replaces `filename`, unless unchanged. Returns whether written."""
+    with atomic_write(filename) as fp:
+      dump(data, fp, json=filename.endswith('.json'), **opts)
 
-  @classmethod
-  def load(cls, filename:str, **opts):
-    opts.setdefault('Loader', FullLoader)
+    return fp.written
 
+  @classmethod
+  def load(cls, filename:str):
     with open(filename) as fp:
-      data = load_yaml(fp, **opts)
+      data = load(fp, json=str(filename).endswith('.json'))
 
     return Settings(data)
 
@@ -1,9 +1,50 @@
 from .settings import get, Settings, Descriptor
+from collections import ChainMap
 from collections.abc import Mapping
-from jinja2 import Environment
+from functools import lru_cache
+from jinja2 import Environment, nodes, Undefined
+from jinja2.parser import Parser
 
 jinja = Environment()
 
+class Expression:
+  """A compiled Jinja expression, reading its variables straight from mappings.
+
+  Same as `jinja.compile_expression`, but the mappings are layered rather
+  than copied into a new context on every call.
+  """
+  __slots__ = ('template',)
+
+  def __init__(self, source:str):
+    parser = Parser(jinja, source, state='variable')
+    expr = parser.parse_expression()
+
+    # Same as jinja.compile_expression
+    if not parser.stream.eos:
+      parser.fail('chunk after expression', parser.stream.current.lineno)
+
+    body = [nodes.Assign(nodes.Name('result', 'store'), expr, lineno=1)]
+    self.template = jinja.from_string(nodes.Template(body, lineno=1))
+
+  def __call__(self, *maps, **kwds):
+    template = self.template
+    context = template.new_context(ChainMap(kwds, *maps, template.globals), shared=True)
+
+    for _ in template.root_render_func(context):
+      pass
+
+    result = context.vars['result']
+    return None if isinstance(result, Undefined) else result
+
+@lru_cache(maxsize=1024)
+def compile_expression(source:str) -> Expression:
+  """Compiles a Jinja expression, once per source.
+
+  The cache is bounded and shared by the whole process, see
+  `compile_expression.cache_info()` for its hits and misses.
+  """
+  return Expression(source)
+
 class Template(Settings):
   template = Descriptor('data')
   fields = Descriptor('fields')
@@ -0,0 +1,32 @@
+from pathlib import Path
+import json
+import os
+import pytest
+import subprocess
+import sys
+
+src = str(Path(__file__).parent.parent / 'src')
+
+class Project:
+  """A tfadm project in a temporary directory, run in a subprocess."""
+  def __init__(self, root:Path):
+    self.root = root
+    (root / '.tfadm' / 'resources').mkdir(parents=True)
+
+  def json(self, filename:str):
+    return json.loads((self.root / filename).read_text())
+
+  def resource(self, name:str, text:str):
+    (self.root / '.tfadm' / 'resources' / (name + '.yml')).write_text(text)
+
+  def run(self, *args, input:str=None) -> str:
+    env = dict(os.environ, PYTHONPATH=src, XDG_CACHE_HOME=str(self.root / '.cache'))
+    proc = subprocess.run([sys.executable, '-m', 'tfadm', *args], cwd=self.root, env=env, input=input, capture_output=True, text=True)
+    return proc.stdout + proc.stderr
+
+  def write(self, filename:str, data):
+    (self.root / filename).write_text(data if isinstance(data, str) else json.dumps(data))
+
+@pytest.fixture
+def project(tmp_path) -> Project:
+  return Project(tmp_path)
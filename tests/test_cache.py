@@ -0,0 +1,171 @@
+from concurrent.futures import ThreadPoolExecutor
+from tfadm.cache import CommandCache, CommandStore, DocumentCache
+from pathlib import Path
+from threading import Event
+from tfadm.settings import detach, Settings
+import json
+import os
+import pytest
+
+def write(path, data):
+  path.write_text(json.dumps(data))
+
+@pytest.fixture
+def document(tmp_path):
+  filename = tmp_path / 'main.tf.json'
+  write(filename, {'resource': {'vpc': {'a': {'cidr': '10.0.0.0/16', 'tags': {'Name': 'a'}}}}})
+  return str(filename)
+
+def test_load_validates(document):
+  cache = DocumentCache()
+  assert cache.load(document).get('resource/vpc/a/cidr') == '10.0.0.0/16'
+
+  # Changed by another program
+  write(Path(document), {'resource': {'vpc': {}}})
+  assert cache.load(document).get('resource/vpc/a') is None
+
+def test_batch_writes_once(document):
+  cache = DocumentCache()
+
+  with cache.batch():
+    for name in ['b', 'c']:
+      with cache.lock(document):
+        terraform = cache.load(document)
+        terraform.merge({'resource': {'vpc': {name: {'cidr': name}}}}, cow=True)
+        assert cache.dump(document, terraform, sort_keys=True) is None
+
+    assert sorted(json.load(open(document))['resource']['vpc']) == ['a']
+
+  assert sorted(json.load(open(document))['resource']['vpc']) == ['a', 'b', 'c']
+
+def test_failure_keeps_saved_changes(document):
+  cache = DocumentCache()
+
+  with cache.batch():
+    with cache.lock(document):
+      terraform = cache.load(document)
+      terraform.merge({'resource': {'vpc': {'b': {'cidr': 'b'}}}}, cow=True)
+      cache.dump(document, terraform)
+
+    with pytest.raises(KeyError):
+      with cache.lock(document):
+        terraform = cache.load(document)
+        settings = detach(terraform.data, 'resource/vpc/a', terraform.get('resource/vpc/a'))
+        settings['tags'].clear()
+        terraform.merge({'resource': {'vpc': {'c': {'cidr': 'c'}}}}, cow=True)
+        raise KeyError('c')
+
+  vpcs = json.load(open(document))['resource']['vpc']
+  assert sorted(vpcs) == ['a', 'b']
+  assert vpcs['a']['tags'] == {'Name': 'a'}
+
+def test_load_shares_unchanged_objects(document):
+  cache = DocumentCache()
+  loaded = []
+
+  with cache.batch():
+    for i in range(100):
+      with cache.lock(document):
+        terraform = cache.load(document)
+        loaded.append(terraform)
+        settings = detach(terraform.data, 'resource/vpc/a', terraform.get('resource/vpc/a'))
+        settings['cidr'] = str(i)
+        terraform.merge({'resource': {'vpc': {str(i): {'cidr': str(i)}}}}, cow=True)
+        cache.dump(document, terraform)
+
+  # Only the changed objects are copied, not the whole document
+  assert all(loaded[-1].get('resource/vpc/' + str(i)) is loaded[i].get('resource/vpc/' + str(i)) for i in range(99))
+  assert json.load(open(document))['resource']['vpc']['a']['cidr'] == '99'
+
+def test_updates_reuse_document(document, monkeypatch):
+  cache = DocumentCache()
+  parsed = []
+  load = Settings.load.__func__
+  monkeypatch.setattr(Settings, 'load', classmethod(lambda cls, filename: parsed.append(filename) or load(cls, filename)))
+
+  for i in range(10):
+    with cache.lock(document):
+      terraform = cache.load(document)
+      previous = terraform.get('resource/vpc')
+      terraform.merge({'resource': {'vpc': {str(i): {'cidr': str(i)}}}}, cow=True)
+      assert cache.dump(document, terraform)
+
+      # Written through, without copying objects it did not change
+      assert cache.load(document).get('resource/vpc/a') is previous['a']
+
+  assert len(parsed) == 1
+  assert len(json.load(open(document))['resource']['vpc']) == 11
+
+def test_command_store(tmp_path):
+  store = CommandStore(tmp_path / 'commands', 60)
+  assert store.load(['ls']) is None
+
+  store.save(['ls'], b'[1]')
+  assert ['ls'] in store
+  assert store.load(['ls']) == b'[1]'
+  assert store.load(['ls', '-l']) is None
+  assert CommandStore(tmp_path / 'commands', 60, refresh=True).load(['ls']) is None
+
+  # Never committed with the project
+  assert (tmp_path / 'commands' / '.gitignore').read_text() == '*\n'
+  assert (tmp_path / 'commands').stat().st_mode & 0o077 == 0
+
+def test_command_store_expires(tmp_path):
+  store = CommandStore(tmp_path, 60)
+  store.save(['ls'], b'[1]')
+  filename = store.filename(['ls'])
+  os.utime(filename, (0, 0))
+  assert store.load(['ls']) is None
+
+def test_command_cache_single_flight():
+  cache = CommandCache()
+  started = Event()
+  release = Event()
+  calls = []
+
+  def fn():
+    calls.append(1)
+    started.set()
+    release.wait(5)
+    return [{'a': 1}, 10]
+
+  flight = cache.start(['ls'], fn)
+  started.wait(5)
+
+  # Already running, so waiting for the same run
+  assert cache.start(['ls'], fn) is None
+  assert ['ls'] in cache
+  waiters = ThreadPoolExecutor(4)
+  results = [waiters.submit(cache.run, ['ls'], fn) for _ in range(4)]
+  release.set()
+
+  assert flight.result(5) == {'a': 1}
+  assert all(_.result(5) == [{'a': 1}, True] for _ in results)
+  assert cache.run(['ls'], fn) == [{'a': 1}, True]
+  assert len(calls) == 1
+  assert cache.stats() == {'hits': 5, 'misses': 1, 'bytes': 10, 'entries': 1}
+
+def test_command_cache_errors():
+  cache = CommandCache()
+
+  def fail():
+    raise OSError('failed')
+
+  with pytest.raises(OSError):
+    cache.run(['ls'], fail)
+
+  with pytest.raises(OSError):
+    cache.start(['ls'], fail).result(5)
+
+  # Not cached
+  assert ['ls'] not in cache
+  assert cache.run(['ls'], lambda: [1, 1]) == [1, False]
+
+def test_command_cache_bounded():
+  cache = CommandCache(maxsize=2)
+
+  for i in range(3):
+    cache.run([str(i)], lambda: [i, 1])
+
+  assert ['0'] not in cache
+  assert ['1'] in cache and ['2'] in cache
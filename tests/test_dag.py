@@ -0,0 +1,65 @@
+from tfadm.dag import execute, toposort, CycleError
+from threading import Lock
+import pytest
+import time
+
+depends_on = {'subnet': ['vpc'], 'nat': ['subnet', 'eip'], 'vpc': [], 'eip': []}
+
+def test_toposort_keeps_order():
+  assert toposort(['nat', 'subnet', 'eip', 'vpc'], depends_on) == ['eip', 'vpc', 'subnet', 'nat']
+  assert toposort(['a', 'b', 'c'], {}) == ['a', 'b', 'c']
+
+def test_toposort_cycle():
+  with pytest.raises(CycleError) as e:
+    toposort(['a', 'b', 'c'], {'a': ['c'], 'b': ['a'], 'c': ['b']})
+
+  assert e.value.cycle == ['a', 'c', 'b', 'a']
+
+@pytest.mark.parametrize('jobs', [1, 2, 4])
+def test_execute_after_dependencies(jobs):
+  done = []
+  lock = Lock()
+
+  def callback(node):
+    with lock:
+      assert all(_ in done for _ in depends_on[node])
+
+    time.sleep(0.01)
+
+    with lock:
+      done.append(node)
+
+  assert execute(list(depends_on), depends_on, callback, jobs) == 4
+  assert sorted(done) == sorted(depends_on)
+
+def test_execute_concurrently():
+  running = []
+  peak = []
+  lock = Lock()
+
+  def callback(node):
+    with lock:
+      running.append(node)
+      peak.append(len(running))
+
+    time.sleep(0.05)
+
+    with lock:
+      running.remove(node)
+
+  execute(['a', 'b', 'c'], {}, callback, 3)
+  assert max(peak) == 3
+
+def test_execute_stops_on_error():
+  called = []
+
+  def callback(node):
+    called.append(node)
+
+    if node == 'vpc':
+      raise ValueError(node)
+
+  with pytest.raises(ValueError):
+    execute(['vpc', 'subnet', 'nat'], {'subnet': ['vpc'], 'nat': ['subnet']}, callback, 2)
+
+  assert called == ['vpc']
@@ -0,0 +1,32 @@
+from io import BytesIO
+from json import dumps
+from tfadm.parsers import iterjson
+import pytest
+
+class Chunked(BytesIO):
+  """Binary stream returning at most `size` bytes per read."""
+  def __init__(self, data:bytes, size:int):
+    super().__init__(data)
+    self.size = size
+
+  def read1(self, size:int=-1) -> bytes:
+    return super().read1(self.size if size < 0 else min(size, self.size))
+
+items = [1, 2.5, -3e10, 4E-2, 0.125, 10, 'a', None, True, False, {'b': [1.5, {}]}, []]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64])
+def test_iterjson_array(size):
+  assert list(iterjson(Chunked(dumps(items).encode(), size))) == items
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64])
+def test_iterjson_path(size):
+  text = dumps({'next': 1.5, 'items': items, 'count': 12})
+  assert list(iterjson(Chunked(text.encode(), size), ['items'])) == items
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64])
+def test_iterjson_documents(size):
+  assert list(iterjson(Chunked(b'1.5\n{"a": 2e1}\n-7', size))) == [1.5, {'a': 20.0}, -7]
+
+def test_iterjson_number_across_chunks():
+  text = '[ ' + '1,' * 32766 + '3.14]'
+  assert list(iterjson(BytesIO(text.encode())))[-1] == 3.14
@@ -0,0 +1,50 @@
+from tfadm.exceptions import Error
+from tfadm.properties import compile_plan, init, init_batch, sync, sync_batch
+from tfadm.template import compile_expression
+import pytest
+
+plan = compile_plan({
+  'name': {'sync': ['Name', 'Tags/0/Value'], 'primary_key': True, 'translate': {'main': 'primary'}},
+  'cidr': {'sync': 'CidrBlock', 'pattern': r'(?P<net>\d+)\..*'},
+  'size': {'sync': 'Size', 'expr': 'this * 2 if this else none', 'when': 'name != "skip"'},
+  'tags': {'sync': False, 'expr': '{"Name": name}'},
+})
+
+objects = [
+  {'Name': 'main', 'CidrBlock': '10.0.0.0/16', 'Size': 1},
+  {'Tags': [{'Value': 'dev'}], 'CidrBlock': '10.1.0.0/16', 'Size': 2},
+  {'Name': 'skip', 'Size': 3},
+  None,
+]
+
+def test_sync_batch():
+  assert sync_batch(plan, objects) == [sync(plan, _) for _ in objects]
+
+def test_init_batch():
+  rows = [sync(plan, _) for _ in objects]
+  expected = [init(plan, dict(_), defaults=False) for _ in rows]
+  assert init_batch(plan, [dict(_) for _ in rows], defaults=False) == expected
+  assert expected[0] == {'name': 'primary', 'name_': 'primary', 'cidr': '10.0.0.0/16', 'size': 2, 'tags': {'Name': 'primary'}}
+
+def test_init_batch_errors():
+  plan = compile_plan({'a': {'expr': '1 / this'}})
+  rows = init_batch(plan, [{'a': 1}, {'a': 0}, ValueError('x')], defaults=False)
+
+  assert rows[0] == {'a': 1.0}
+  assert isinstance(rows[1], Error) and rows[1].args[0] == 'a/expr'
+  assert isinstance(rows[2], ValueError)
+
+def test_expressions_compiled_once(monkeypatch):
+  plan = compile_plan({'a': {'sync': 'A', 'when': 'A != 7', 'expr': 'this + 700'}})
+  calls = []
+  monkeypatch.setattr('tfadm.properties.compile_expression', lambda _: calls.append(_) or compile_expression(_))
+  rows = init_batch(plan, sync_batch(plan, [{'A': _} for _ in range(100)]), defaults=False)
+
+  assert rows[7] == {'a': 707}
+  assert calls == []
+
+def test_invalid_expression_raised_when_evaluated():
+  plan = compile_plan({'a': {'when': 'a b'}, 'b': {}})
+
+  with pytest.raises(Error, match='a/when'):
+    init(plan, {'a': 1})
@@ -0,0 +1,83 @@
+from asyncio import gather, run, sleep
+from subprocess import CalledProcessError
+from tfadm.runner import Limiter, Retry, Runner
+import pytest
+import sys
+
+def test_limiter_bounds_concurrency():
+  async def main():
+    limiter = Limiter(3)
+    active = []
+
+    async def task():
+      await limiter.acquire()
+      active.append(limiter.active)
+      await sleep(0.01)
+      await limiter.release(True)
+
+    await gather(*[task() for _ in range(10)])
+    return max(active)
+
+  assert run(main()) == 3
+
+def test_limiter_aimd():
+  async def main():
+    limiter = Limiter(8)
+    await limiter.acquire()
+    await limiter.release(False, throttled=True)
+    assert limiter.limit == 4
+
+    for _ in range(3):
+      await limiter.acquire()
+      await limiter.release(False, throttled=True)
+
+    # Never below one
+    assert limiter.limit == 1
+
+    for _ in range(100):
+      await limiter.acquire()
+      await limiter.release(True)
+
+    assert limiter.limit == 8
+
+  run(main())
+
+def test_retry_match():
+  assert Retry().match(1, b'')
+  assert Retry(codes=[255]).match(255, b'')
+  assert not Retry(codes=[255]).match(1, b'')
+  assert Retry(patterns=['Throttl']).match(1, b'An error: Throttling')
+  assert not Retry(patterns=['Throttl']).match(1, None)
+
+def test_retry_backoff():
+  retry = Retry(delay=1, max_delay=5)
+  assert all(0 <= retry.backoff(_) <= min(5, 2 ** (_ - 1)) for _ in range(1, 10) for __ in range(20))
+
+def test_runner_output():
+  runner = Runner(2)
+  assert runner.run([sys.executable, '-c', 'print(1)']) == b'1\n'
+
+  futures = [runner.submit([sys.executable, '-c', 'print({})'.format(_)]) for _ in range(4)]
+  assert [_.result() for _ in futures] == [b'0\n', b'1\n', b'2\n', b'3\n']
+
+def test_runner_retries(tmp_path):
+  counter = tmp_path / 'attempts'
+  script = 'import pathlib, sys; p = pathlib.Path(sys.argv[1]); p.write_text(p.read_text() + "x" if p.exists() else "x"); sys.exit("Throttling" if len(p.read_text()) < 3 else 0)'
+  argv = [sys.executable, '-c', script, str(counter)]
+  runner = Runner(2)
+
+  assert runner.run(argv, Retry(attempts=3, patterns=['Throttling'], delay=0)) == b''
+  assert counter.read_text() == 'xxx'
+
+  counter.unlink()
+
+  with pytest.raises(CalledProcessError):
+    runner.run(argv, Retry(attempts=2, patterns=['Throttling'], delay=0))
+
+  counter.unlink()
+
+  # Not retried, unless it matches
+  with pytest.raises(CalledProcessError):
+    runner.run(argv, Retry(attempts=3, codes=[2], delay=0))
+
+  assert counter.read_text() == 'x'
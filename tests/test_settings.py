@@ -0,0 +1,13 @@
+from tfadm.settings import vformat
+import pytest
+
+@pytest.mark.parametrize('format_spec, values', [
+  ('{}-{}', ('a', 'b')),
+  ('{:{}}', ('x', '>5')),
+  ('{}{:{}}', ('a', 'b', '^5')),
+  ('{:{}.{}}', (3.14159, 8, 3)),
+  ('{name}:{:>{}}', ('v', 4)),
+  ('{1}{0}', ('a', 'b')),
+])
+def test_vformat(format_spec, values):
+  assert vformat(format_spec, {'name': 'n'}, *values) == format_spec.format(*values, name='n')
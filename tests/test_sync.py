@@ -0,0 +1,114 @@
+import pytest
+
+vpc = '''
+source: '{name}/main.tf.json'
+address: 'resource/vpc/{name}'
+path: [name]
+properties:
+  name:
+    sync: Name
+    primary_key: true
+  id:
+    sync: VpcId
+    inherit: true
+    ignore: true
+    translate:
+      vpc-1: main
+      vpc-2: dev
+methods:
+  sync:
+    list: cat vpcs.json
+'''
+
+subnet = '''
+parent: vpc
+source: subnets.tf.json
+address: 'resource/subnet/{subnet}'
+path: [subnet]
+properties:
+  id:
+    sync: VpcId
+    ignore: true
+  subnet:
+    sync: SubnetId
+    primary_key: true
+  cidr:
+    sync: CidrBlock
+methods:
+  sync:
+    bulk: cat subnets.json
+    describe: 'cat subnets-{id}.json'
+'''
+
+vpcs = [{'Name': 'one', 'VpcId': 'vpc-1'}, {'Name': 'two', 'VpcId': 'vpc-2'}]
+
+subnets = [
+  {'SubnetId': 'subnet-a', 'VpcId': 'vpc-1', 'CidrBlock': '10.0.1.0/24'},
+  {'SubnetId': 'subnet-b', 'VpcId': 'vpc-1', 'CidrBlock': '10.0.2.0/24'},
+  {'SubnetId': 'subnet-c', 'VpcId': 'vpc-2', 'CidrBlock': '10.1.1.0/24'},
+]
+
+def test_bulk_translated_parent_key(project):
+  project.resource('vpc', vpc)
+  project.resource('subnet', subnet)
+  project.write('vpcs.json', vpcs)
+  project.write('subnets.json', subnets)
+
+  output = project.run('sync', '-r', 'vpc')
+
+  # Run once for all parents, instead of describing each one
+  assert output.count('$ cat subnets.json') == 1, output
+  assert 'subnets-' not in output
+  assert sorted(project.json('one/subnets.tf.json')['resource']['subnet']) == ['subnet-a', 'subnet-b']
+  assert sorted(project.json('two/subnets.tf.json')['resource']['subnet']) == ['subnet-c']
+
+@pytest.mark.parametrize('concurrency', [0, -1, 1])
+def test_batch_concurrency(project, concurrency):
+  project.resource('vpc', vpc.replace('  sync:\n', '  sync:\n    concurrency: {}\n'.format(concurrency)))
+  project.write('vpcs.json', vpcs)
+
+  output = project.run('sync', 'vpc', '-', input='name: one\n---\nname: two\n')
+
+  assert 'Created two/main.tf.json' in output, output
+  assert project.json('one/main.tf.json')['resource']['vpc']['one'] == {'name': 'one'}
+
+flaky = '''
+import pathlib, sys
+count = pathlib.Path('attempts')
+count.write_text(count.read_text() + 'x' if count.exists() else 'x')
+
+if len(count.read_text()) < int(sys.argv[1]):
+  if sys.argv[2] == 'late':
+    print('[{"Name": "one", "VpcId": "vpc-1"}', flush=True)
+
+  sys.exit('Throttling')
+
+print('[{"Name": "one", "VpcId": "vpc-1"}, {"Name": "two", "VpcId": "vpc-2"}]')
+'''
+
+@pytest.mark.parametrize('when, attempts', [('early', 3), ('late', 1)])
+def test_stream_retry(project, when, attempts):
+  retry = '    stream: true\n    retry:\n      patterns: Throttling\n      delay: 0\n'
+  project.resource('vpc', vpc.replace('list: cat vpcs.json', 'list: python3 flaky.py 3 ' + when).replace('  sync:\n', '  sync:\n' + retry))
+  project.write('flaky.py', flaky)
+
+  output = project.run('sync', 'vpc')
+
+  # Only retried until an object is synced
+  assert len((project.root / 'attempts').read_text()) == attempts, output
+  assert ('Created two/main.tf.json' in output) == (when == 'early'), output
+
+@pytest.mark.parametrize('join', [False, True])
+def test_join_missing_parent_key(project, join):
+  project.resource('vpc', vpc)
+  project.resource('subnet', subnet.replace('  sync:\n', '  sync:\n    join: {}\n'.format(str(join).lower())))
+  project.write('vpcs.json', vpcs)
+
+  for i, name in [('vpc-1', 'main'), ('vpc-2', 'dev')]:
+    project.write('subnets-{}.json'.format(name), [_ for _ in subnets if _['VpcId'] == i])
+
+  # Parents looked up by their translated id
+  output = project.run('sync', 'subnet', '-', input='id: main\nsubnet: subnet-a\n---\nid: dev\nsubnet: subnet-c\n')
+
+  assert sorted(project.json('one/subnets.tf.json')['resource']['subnet']) == ['subnet-a'], output
+  assert sorted(project.json('two/subnets.tf.json')['resource']['subnet']) == ['subnet-c'], output
@@ -0,0 +1,25 @@
+from jinja2 import TemplateSyntaxError
+from tfadm.template import compile_expression
+import pytest
+
+def test_expression_layers():
+  expr = compile_expression('a + b')
+  assert expr({'a': 1}, {'a': 10, 'b': 2}) == 3
+  assert expr({'a': 1, 'b': 2}, b=5) == 6
+
+def test_expression_does_not_change_maps():
+  args = {'a': 1}
+  assert compile_expression('a is defined and b is not defined')(args)
+  assert args == {'a': 1}
+
+def test_expression_undefined():
+  assert compile_expression('missing')({}) is None
+  assert compile_expression('missing is not defined')({})
+
+def test_expression_cached():
+  assert compile_expression('x') is compile_expression('x')
+
+@pytest.mark.parametrize('source', ['a b', 'a.b c', '1 2'])
+def test_expression_trailing_tokens(source):
+  with pytest.raises(TemplateSyntaxError, match='chunk after expression'):
+    compile_expression(source)